@@ -0,0 +1,143 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from itertools import islice
+from typing import Callable, Deque, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+import engines
+from grid import BoxGrid
+from packed import open_corpus
+from parallel import pool_worker
+
+
+class BatchResult(NamedTuple):
+    """The outcome of solving one puzzle of a batch
+
+    `index` is the puzzle's position in the input, and puzzles are passed around in the compact form of
+    `BoxGrid.to_string`. If the puzzle could not be solved, `solution` is None and `error` holds the exception raised.
+    """
+    index: int
+    puzzle: str
+    solution: Optional[str]
+    error: Optional[Exception] = None
+
+    @property
+    def solved(self) -> bool:
+        return self.error is None
+
+
+Chunk = List[Tuple[int, str]]
+# A run of puzzles from a corpus file, as (path, start, stop)
+Span = Tuple[str, int, int]
+
+
+def solve_puzzle(index: int, puzzle: str, engine: str='heuristic', *, block_height: int=None, block_width: int=None,
+                 **limits) -> BatchResult:
+    """Solve a single puzzle, capturing any error in the result rather than raising it
+
+    The blocks are the usual shape for the puzzle's size unless given. Any `limits` (`deadline` and `max_nodes`) are
+    passed on to `engines.solve`.
+    """
+    try:
+        grid = BoxGrid.from_string(puzzle, block_height=block_height, block_width=block_width)
+        engines.solve(grid, engine=engine, **limits)
+    except Exception as e:
+        return BatchResult(index, puzzle, None, e)
+    return BatchResult(index, puzzle, grid.to_string())
+
+
+def solve_chunk(chunk: Chunk, engine: str='heuristic', block_height: int=None, block_width: int=None
+                ) -> List[BatchResult]:
+    return [solve_puzzle(index, puzzle, engine, block_height=block_height, block_width=block_width)
+            for index, puzzle in chunk]
+
+
+def solve_span(span: Span, engine: str='heuristic', vectorize: bool=False) -> List[BatchResult]:
+    """Solve a run of puzzles from a corpus file, which is opened in this process if it isn't already
+
+    The puzzles have the shape of blocks given in the file's header.
+    """
+    path, start, stop = span
+    corpus = open_corpus(path)
+    chunk = [(i, corpus[i]) for i in range(start, stop)]
+    if vectorize:
+        import vectorized
+        return vectorized.solve_chunk(chunk, engine, corpus.block_height, corpus.block_width)
+    return solve_chunk(chunk, engine, corpus.block_height, corpus.block_width)
+
+
+def chunked(puzzles: Iterable[Union[str, BoxGrid]], chunksize: int) -> Iterator[Chunk]:
+    """Number the puzzles, encode any grids, and group them into chunks to be sent to the workers"""
+    numbered = ((n, p.to_string() if isinstance(p, BoxGrid) else p.strip()) for n, p in enumerate(puzzles))
+    while True:
+        chunk = list(islice(numbered, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def solve_many(puzzles: Iterable[Union[str, BoxGrid]], *, workers: Optional[int]=None, chunksize: int=64,
+               ordered: bool=True, engine: str='heuristic', vectorize: bool=False) -> Iterator[BatchResult]:
+    """Solve many puzzles across a pool of processes, yielding a `BatchResult` for each
+
+    Puzzles may be grids or strings as read by `BoxGrid.from_string`. They are read lazily, with only a few chunks per
+    worker in flight at once, so `puzzles` can be a generator over more puzzles than would fit in memory. With `ordered`
+    the results come back in the same order as the puzzles, otherwise each chunk's results are given as soon as they are
+    done. A puzzle which cannot be solved doesn't stop the batch, it just has its exception put in its result.
+
+    `workers` defaults to the number of processors, and with a single worker everything is solved in this process.
+    With `vectorize`, each chunk is first put through the NumPy propagation of `vectorized`, and only what that leaves
+    unsolved goes to `engine`, which pays off with larger chunks.
+    """
+    if vectorize:
+        import vectorized
+        chunk_solver = vectorized.solve_chunk
+    else:
+        chunk_solver = solve_chunk
+
+    yield from run_chunks(chunk_solver, chunked(puzzles, chunksize), (engine,), workers=workers, ordered=ordered)
+
+
+def solve_corpus(path: str, *, workers: Optional[int]=None, chunksize: int=64, ordered: bool=True,
+                 engine: str='heuristic', vectorize: bool=False, start: int=0, stop: Optional[int]=None
+                 ) -> Iterator[BatchResult]:
+    """Solve the puzzles of a corpus file (see `packed`) across a pool of processes, as `solve_many` does
+
+    Only the path and the range of puzzles are sent to the workers, which map the file for themselves, so nothing is
+    read here and the puzzles aren't copied between processes. `start` and `stop` pick out a range of the puzzles.
+    """
+    path = str(path)
+    count = len(open_corpus(path))
+    stop = count if stop is None else min(stop, count)
+    spans = ((path, i, min(i + chunksize, stop)) for i in range(start, stop, chunksize))
+    yield from run_chunks(solve_span, spans, (engine, vectorize), workers=workers, ordered=ordered)
+
+
+def run_chunks(chunk_solver: Callable[..., List[BatchResult]], chunks: Iterator, args: tuple, *,
+               workers: Optional[int]=None, ordered: bool=True) -> Iterator[BatchResult]:
+    """Call `chunk_solver(chunk, *args)` on each chunk across a pool of processes, yielding the results of each"""
+    if workers == 1:
+        for chunk in chunks:
+            yield from chunk_solver(chunk, *args)
+        return
+
+    # The workers are already one a processor, so the 'parallel' engine solves in each of them rather than adding more
+    with ProcessPoolExecutor(max_workers=workers, initializer=pool_worker) as executor:
+        # Keep every worker busy, with a little slack, without reading the whole input in up front
+        max_in_flight = 4 * executor._max_workers
+        submit = lambda chunk: executor.submit(chunk_solver, chunk, *args)
+
+        if ordered:
+            in_order: Deque[Future] = deque(submit(chunk) for chunk in islice(chunks, max_in_flight))
+            while in_order:
+                results = in_order.popleft().result()
+                for chunk in islice(chunks, 1):
+                    in_order.append(submit(chunk))
+                yield from results
+        else:
+            pending: Set[Future] = {submit(chunk) for chunk in islice(chunks, max_in_flight)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for chunk in islice(chunks, len(done)):
+                    pending.add(submit(chunk))
+                for future in done:
+                    yield from future.result()
@@ -0,0 +1,213 @@
+"""Reproducible benchmarks of the solver engines against the graded corpus
+
+    python benchmark.py run --engine heuristic --engine dlx --count 50 --out results.json
+    python benchmark.py compare baseline.json results.json
+
+`run` solves every grade of `corpus.graded_corpus` (or the puzzles of a corpus file made by `packed`) with each
+engine, and reports the wall time, puzzles per second, peak memory and latency percentiles of each. `compare` flags
+anything which has got slower (or hungrier) by more than the threshold, exiting with 1 if there is anything to flag.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from time import perf_counter
+from typing import Callable, Dict, Iterable, List, Sequence
+
+import engines
+from corpus import GRADES, graded_corpus
+from grid import BoxGrid
+from packed import CorpusFile
+from solver import UnsolvableException
+
+# The measures `compare` checks, all of which are worse when higher
+COMPARED = ('wall_seconds', 'p50_ms', 'p90_ms', 'p99_ms', 'peak_memory_bytes')
+# And those which are worse when lower, so that a run which fails quickly doesn't look like a speed up
+COMPARED_LOWER = ('puzzles_per_second',)
+
+
+def percentile(ordered: Sequence[float], fraction: float) -> float:
+    """The value `fraction` of the way through an already sorted sequence, interpolating between neighbours"""
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def measure(grids: Callable[[], Iterable[BoxGrid]], engine: str, **options) -> Dict[str, float]:
+    """Solve each grid with the engine, timing them, and then solve them again to find the peak memory used
+
+    `grids` makes the grids afresh for each pass, so they can be read lazily from a corpus file rather than all held in
+    memory. Memory is traced in a separate pass, as tracing slows everything down too much to time at the same time.
+    """
+    latencies = []
+    failures = 0
+    start = perf_counter()
+    for grid in grids():
+        solve_start = perf_counter()
+        try:
+            engines.solve(grid, engine=engine, **options)
+        except UnsolvableException:
+            # Only the engine failing to solve the puzzle counts, anything else is a mistake in how it was run
+            failures += 1
+        latencies.append(perf_counter() - solve_start)
+    wall = perf_counter() - start
+
+    tracemalloc.start()
+    for grid in grids():
+        try:
+            engines.solve(grid, engine=engine, **options)
+        except UnsolvableException:
+            pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'puzzles': len(latencies),
+        'failures': failures,
+        'wall_seconds': wall,
+        'puzzles_per_second': len(latencies) / wall if wall else float('inf'),
+        'peak_memory_bytes': peak,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p90_ms': percentile(latencies, 0.9) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def run(engine_names: Sequence[str]=('heuristic',), *, count: int=20, seed: int=0, grades: Sequence[str]=GRADES,
+        options: Dict[str, object]=None, corpus_file: str=None) -> dict:
+    """Benchmark each engine on each grade of the corpus, returning results ready to be saved as JSON
+
+    Any `options` are passed on to every engine, and are included in the name the engine's results are kept under.
+    With `corpus_file`, the first `count` puzzles of that file (or all of them if `count` is 0) are used instead of the
+    graded corpus, as a single grade named after the file.
+    """
+    options = options or {}
+    suffix = f"[{','.join(f'{k}={v}' for k, v in sorted(options.items()))}]" if options else ''
+    if corpus_file is not None:
+        name = os.path.basename(corpus_file)
+        corpus_puzzles = CorpusFile(corpus_file)
+        # Read from the mapped file as they are solved, without copying the corpus into memory
+        corpus = {name: lambda: corpus_puzzles.grids(0, count or None)}
+        grades = [name]
+    else:
+        corpus = {grade: (lambda puzzles=puzzles: map(BoxGrid.from_string, puzzles))
+                  for grade, puzzles in graded_corpus(count, seed, grades=grades).items()}
+    results = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'count': count,
+            'seed': seed,
+            'corpus_file': corpus_file,
+            'options': options,
+        },
+        'results': {},
+    }
+    try:
+        for engine in engine_names:
+            results['results'][engine + suffix] = {grade: measure(corpus[grade], engine, **options) for grade in grades}
+    finally:
+        if corpus_file is not None:
+            corpus_puzzles.close()
+    return results
+
+
+def compare(baseline: dict, current: dict, threshold: float=0.1) -> List[str]:
+    """List everything measured in both runs which is more than `threshold` (as a fraction) worse in `current`
+
+    Any more failures at all than before is flagged too.
+    """
+    regressions = []
+    for engine, grades in current['results'].items():
+        for grade, measures in grades.items():
+            before = baseline['results'].get(engine, {}).get(grade)
+            if before is None:
+                continue
+            if measures['failures'] > before['failures']:
+                regressions.append(f"{engine}/{grade}: failures went from {before['failures']} "
+                                   f"to {measures['failures']}")
+            for measure_name in COMPARED:
+                old, new = before[measure_name], measures[measure_name]
+                if old and (new - old) / old > threshold:
+                    regressions.append(f"{engine}/{grade}: {measure_name} went from {old:.4g} to {new:.4g} "
+                                       f"(+{(new - old) / old:.0%})")
+            for measure_name in COMPARED_LOWER:
+                old, new = before[measure_name], measures[measure_name]
+                if old and (old - new) / old > threshold:
+                    regressions.append(f"{engine}/{grade}: {measure_name} went from {old:.4g} to {new:.4g} "
+                                       f"({(new - old) / old:.0%})")
+    return regressions
+
+
+def format_results(results: dict) -> str:
+    lines = [f"{'engine':<36}{'grade':<12}{'puzzles':>8}{'failed':>8}{'per sec':>10}{'p50 ms':>10}{'p90 ms':>10}"
+             f"{'p99 ms':>10}{'max ms':>10}{'peak KiB':>10}"]
+    for engine, grades in results['results'].items():
+        for grade, m in grades.items():
+            lines.append(f"{engine:<36}{grade:<12}{m['puzzles']:>8}{m['failures']:>8}{m['puzzles_per_second']:>10.1f}"
+                         f"{m['p50_ms']:>10.2f}{m['p90_ms']:>10.2f}{m['p99_ms']:>10.2f}{m['max_ms']:>10.2f}"
+                         f"{m['peak_memory_bytes'] / 1024:>10.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the solver engines against a graded corpus")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--engine', action='append', choices=list(engines.ENGINES),
+                            help="engine to benchmark, may be given more than once (default: all)")
+    run_parser.add_argument('--grade', action='append', choices=GRADES, help="grade to run (default: all)")
+    run_parser.add_argument('--count', type=int, default=20, help="puzzles per grade")
+    run_parser.add_argument('--seed', type=int, default=0, help="seed for generating the corpus")
+    run_parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                            help="option to pass to the engines, with the value read as JSON (e.g. max_emergency_depth=10)")
+    run_parser.add_argument('--corpus', metavar='PATH',
+                            help="benchmark the puzzles of a corpus file made by packed.py, not the graded corpus")
+    run_parser.add_argument('--out', help="file to save the results to, as JSON")
+
+    compare_parser = commands.add_parser('compare', help="compare two saved runs, flagging regressions")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help="how much worse (as a fraction) something has to be to be flagged")
+
+    args = parser.parse_args(argv)
+    # Don't let the solver's warnings drown out the results
+    logging.getLogger('solver').setLevel(logging.ERROR)
+
+    if args.command == 'run':
+        options = {}
+        for option in args.option:
+            name, _, value = option.partition('=')
+            options[name] = json.loads(value)
+        results = run(args.engine or list(engines.ENGINES), count=args.count, seed=args.seed,
+                      grades=args.grade or GRADES, options=options, corpus_file=args.corpus)
+        print(format_results(results))
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(regression)
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Caching of solutions under a canonical form, so that puzzles which are the same up to symmetry are only solved once
+
+Two puzzles are taken to be the same if one can be turned into the other by relabelling the values, reordering the
+rows within a band or the bands themselves, doing the same for columns and stacks, and (for square blocks) transposing.
+`canonicalize` picks out one representative of all of these, along with the `Transform` which gets there, so a cached
+solution can be mapped back onto whichever version of the puzzle was asked about.
+"""
+import dbm
+import random
+from collections import OrderedDict
+from itertools import permutations, product
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from grid import SYMBOLS, BoxGrid
+
+# Past this many partial transforms still in the running, the puzzle is too symmetric (or too empty) to be worth it
+MAX_CANDIDATES = 20000
+
+
+class Transform(NamedTuple):
+    """A symmetry of the grid: canonical[i][j] = relabel[puzzle[rows[i]][columns[j]]], after transposing if asked"""
+    transpose: bool
+    rows: Tuple[int, ...]
+    columns: Tuple[int, ...]
+    # relabel[v] is what value v becomes, with relabel[0] == 0 for empty boxes
+    relabel: Tuple[int, ...]
+
+    def apply(self, values: Sequence[int]) -> List[int]:
+        """Transform a puzzle, given as its values row by row with 0 for empty boxes"""
+        size = len(self.rows)
+        source = transposed(values, size) if self.transpose else values
+        return [self.relabel[source[r * size + c]] for r in self.rows for c in self.columns]
+
+    def undo(self, values: Sequence[int]) -> List[int]:
+        """Turn a transformed grid back to the original orientation and labels"""
+        size = len(self.rows)
+        unlabel = [0] * len(self.relabel)
+        for original, label in enumerate(self.relabel):
+            unlabel[label] = original
+        source = [0] * (size * size)
+        for i, r in enumerate(self.rows):
+            for j, c in enumerate(self.columns):
+                source[r * size + c] = unlabel[values[i * size + j]]
+        return transposed(source, size) if self.transpose else source
+
+
+def transposed(values: Sequence[int], size: int) -> List[int]:
+    return [values[c * size + r] for r in range(size) for c in range(size)]
+
+
+def to_values(puzzle: str) -> List[int]:
+    return [0 if symbol in '.0' else SYMBOLS.index(symbol.upper()) + 1 for symbol in puzzle]
+
+
+def to_puzzle(values: Sequence[int]) -> str:
+    return ''.join(SYMBOLS[v - 1] if v else '.' for v in values)
+
+
+def group_orders(size: int, group: int) -> List[Tuple[int, ...]]:
+    """Every reordering of 0..size-1 that keeps each run of `group` together, as bands and stacks are kept"""
+    groups = [tuple(range(start, start + group)) for start in range(0, size, group)]
+    orders = []
+    for group_order in permutations(groups):
+        for insides in product(*(permutations(g) for g in group_order)):
+            orders.append(tuple(n for inside in insides for n in inside))
+    return orders
+
+
+def random_group_order(size: int, group: int, rng: random.Random) -> Tuple[int, ...]:
+    """One of `group_orders(size, group)` picked at random, without listing them all, as larger grids have trillions"""
+    groups = [list(range(start, start + group)) for start in range(0, size, group)]
+    rng.shuffle(groups)
+    for inside in groups:
+        rng.shuffle(inside)
+    return tuple(n for inside in groups for n in inside)
+
+
+def row_choices(chosen: Tuple[int, ...], band_height: int, size: int) -> Iterator[int]:
+    """The rows which could come next, given the rows already placed"""
+    if len(chosen) % band_height:
+        band = chosen[-1] // band_height
+        yield from (r for r in range(band * band_height, (band + 1) * band_height) if r not in chosen)
+    else:
+        used = {r // band_height for r in chosen}
+        yield from (r for r in range(size) if r // band_height not in used)
+
+
+def first_row_pattern(row: Sequence[int], stack_width: int) -> Tuple[int, ...]:
+    """The smallest the row can be made as the first row, with 1 for each filled box
+
+    As values are labelled in order of appearance, the first row comes out as its empty boxes in some order followed by
+    1, 2, 3..., so the only thing to choose is how far forward the empty boxes go. That means putting the stacks with the
+    most empty boxes first, and the empty boxes first within each stack.
+    """
+    filled = sorted(sum(1 for v in row[start:start + stack_width] if v) for start in range(0, len(row), stack_width))
+    return tuple(n < count for count in filled for n in range(stack_width - 1, -1, -1))
+
+
+def first_row_orders(row: Sequence[int], stack_width: int) -> Iterator[Tuple[int, ...]]:
+    """Every column order which makes the row its `first_row_pattern`, which is any order among equals"""
+    size = len(row)
+    stacks = [tuple(range(start, start + stack_width)) for start in range(0, size, stack_width)]
+    empties = {stack: sum(not row[c] for c in stack) for stack in stacks}
+    tied_stacks = [[s for s in stacks if empties[s] == n] for n in sorted(set(empties.values()), reverse=True)]
+    insides = {
+        stack: [empty + filled for empty in permutations(c for c in stack if not row[c])
+                for filled in permutations(c for c in stack if row[c])]
+        for stack in stacks
+    }
+    for stack_order in product(*(permutations(tied) for tied in tied_stacks)):
+        stack_order = [stack for tied in stack_order for stack in tied]
+        for inside in product(*(insides[stack] for stack in stack_order)):
+            yield tuple(c for part in inside for c in part)
+
+
+def canonicalize(puzzle: str, block_height: int, block_width: int) -> Tuple[str, Transform]:
+    """Find the canonical form of a puzzle, and the transform which takes the puzzle to it
+
+    The canonical form is the lexicographically smallest transformed puzzle (empty boxes first), with values labelled
+    in order of first appearance. It is found row by row, keeping only the partial transforms which give the smallest
+    rows so far. Puzzles with too many of those (such as nearly empty ones) just use themselves as their canonical form.
+    """
+    values = to_values(puzzle)
+    size = round(len(values) ** 0.5)
+    identity = Transform(False, tuple(range(size)), tuple(range(size)), tuple(range(size + 1)))
+    # Transposing swaps bands with stacks, so is only a symmetry when blocks are square
+    sources = {False: values}
+    if block_height == block_width:
+        sources[True] = transposed(values, size)
+
+    # Each candidate is (transpose, rows so far, column order, labels so far), all tied for the smallest output so far
+    candidates: List[Tuple[bool, Tuple[int, ...], Tuple[int, ...], Dict[int, int]]] = []
+    first_rows = [(first_row_pattern(source[r * size:(r + 1) * size], block_width), transpose, r)
+                  for transpose, source in sources.items() for r in range(size)]
+    best_pattern = min(first_rows)[0]
+    for pattern, transpose, r in first_rows:
+        if pattern != best_pattern:
+            continue
+        row = sources[transpose][r * size:(r + 1) * size]
+        for columns in first_row_orders(row, block_width):
+            labels = {0: 0}
+            for c in columns:
+                if row[c] not in labels:
+                    labels[row[c]] = len(labels)
+            candidates.append((transpose, (r,), columns, labels))
+            if len(candidates) > MAX_CANDIDATES:
+                return puzzle, identity
+    output, label = [], 0
+    for filled in best_pattern:
+        label += filled
+        output.append(label if filled else 0)
+
+    for _ in range(size - 1):
+        best_row, best = None, []
+        for transpose, rows, columns, labels in candidates:
+            source = sources[transpose]
+            for r in row_choices(rows, block_height, size):
+                new_labels = dict(labels)
+                row = []
+                for c in columns:
+                    v = source[r * size + c]
+                    if v not in new_labels:
+                        new_labels[v] = len(new_labels)
+                    row.append(new_labels[v])
+                if best_row is None or row < best_row:
+                    best_row, best = row, []
+                if row == best_row:
+                    best.append((transpose, rows + (r,), columns, new_labels))
+        if len(best) > MAX_CANDIDATES:
+            return puzzle, identity
+        output.extend(best_row)
+        candidates = best
+
+    transpose, rows, columns, labels = candidates[0]
+    # Values which never appear in the puzzle are labelled last, smallest first
+    for v in range(1, size + 1):
+        if v not in labels:
+            labels[v] = len(labels)
+    relabel = tuple(labels[v] for v in range(size + 1))
+    return to_puzzle(output), Transform(transpose, rows, columns, relabel)
+
+
+class SolutionCache:
+    """A bounded, least recently used, cache of solutions kept under each puzzle's canonical form
+
+    Solutions are kept in memory, and, if a `path` is given, in a dbm file there too so they outlive the process. Only
+    the in-memory part is bounded by `maxsize`.
+    """
+
+    def __init__(self, maxsize: int=4096, path: str=None):
+        self.maxsize = maxsize
+        self._memory: 'OrderedDict[str, str]' = OrderedDict()
+        self._keys: 'OrderedDict[str, Tuple[str, Transform]]' = OrderedDict()
+        self._disk = dbm.open(path, 'c') if path is not None else None
+        self.hits = 0
+        self.misses = 0
+
+    def known_key(self, puzzle: str) -> Optional[Tuple[str, Transform]]:
+        """The key of a puzzle (as from `BoxGrid.to_string`) that `key` has already worked out, if it is remembered
+
+        This never canonicalizes, so it costs next to nothing, and is worth trying on any puzzle.
+        """
+        found = self._keys.get(puzzle)
+        if found is not None:
+            self._keys.move_to_end(puzzle)
+        return found
+
+    def key(self, grid: BoxGrid, puzzle: str=None) -> Tuple[str, Transform]:
+        """The key the grid's puzzle is cached under, and the transform from the grid to that canonical form
+
+        `puzzle` is the grid's puzzle as from `BoxGrid.to_string`, if the grid has moved on from it. Canonical forms are
+        remembered for exact repeats of a puzzle, so those skip canonicalizing too, but a new puzzle takes as long to
+        canonicalize as an easy one takes to solve, so it is only worth it for those which need searching.
+        """
+        if puzzle is None:
+            puzzle = grid.to_string()
+        found = self.known_key(puzzle)
+        if found is not None:
+            return found
+        canonical, transform = canonicalize(puzzle, grid.block_height, grid.block_width)
+        found = self._keys[puzzle] = f'{grid.block_height}x{grid.block_width}:{canonical}', transform
+        if len(self._keys) > self.maxsize:
+            self._keys.popitem(last=False)
+        return found
+
+    def get(self, grid: BoxGrid) -> Optional[str]:
+        """Get the solution of the grid's puzzle, in the grid's own orientation, if it (or an equivalent) is cached"""
+        return self.lookup(*self.key(grid))
+
+    def put(self, grid: BoxGrid, solution: str):
+        """Cache the solution (as from `BoxGrid.to_string`) of the puzzle currently in the grid"""
+        self.store(*self.key(grid), solution)
+
+    def lookup(self, key: str, transform: Transform) -> Optional[str]:
+        """As `get`, for a key and transform already worked out by `key`"""
+        solution = self._memory.get(key)
+        if solution is not None:
+            self._memory.move_to_end(key)
+        elif self._disk is not None and key in self._disk:
+            solution = self._disk[key].decode('ascii')
+            self._remember(key, solution)
+        if solution is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return to_puzzle(transform.undo(to_values(solution)))
+
+    def store(self, key: str, transform: Transform, solution: str):
+        """As `put`, for a key and transform already worked out by `key`"""
+        solution = to_puzzle(transform.apply(to_values(solution)))
+        self._remember(key, solution)
+        if self._disk is not None:
+            self._disk[key] = solution
+
+    def _remember(self, key: str, solution: str):
+        self._memory[key] = solution
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
@@ -0,0 +1,96 @@
+"""Puzzles graded from easy to diabolical, for benchmarking
+
+A few hand picked puzzles, including those of `utils/examples.py`, are graded by `generator.grade`, so that each grade
+means what the solver's rules make of it rather than what the puzzle's source called it. Each grade can be padded out
+to any size, first with puzzles generated for it (see `generator.generate_many`), so that it has a spread of different
+puzzles, and then with random equivalents of those (see `cache.Transform`), which are just as hard to solve but can't be
+answered from memory.
+"""
+import random
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+
+from cache import Transform, random_group_order, to_puzzle, to_values
+
+GRADES = ('easy', 'medium', 'hard', 'diabolical')
+# How many different puzzles each grade has (if it is padded out to that many), before random equivalents are used,
+# which is as many as there are hand picked hard puzzles, as generating more of those takes minutes
+DISTINCT = 8
+
+PUZZLES: Dict[str, str] = {
+    # http://elmo.sbs.arizona.edu/sandiway/sudoku/examples.html - Arizona Daily Wildcat: Tuesday, Jan 17th 2006
+    'example1': '...26.7.168..7..9.19...45..82.1...4...46.29...5...3.28..93...74.4..5..367.3.18...',
+    # http://www.sudokuessentials.com/support-files/sudoku-easy-1.pdf - Sudoku Essentials E1
+    'example2': '8..93...2..9....4.7.21..96.2......9..6.....7..7...6..5.27..84.6.3....5..5...62..8',
+    # http://elmo.sbs.arizona.edu/sandiway/sudoku/examples.html - Daily Telegraph January 19th "Diabolical"
+    'example3': '.2.6.8...58...97......4....37....5..6.......4..8....13....2......98...36...3.6.9.',
+    # http://elmo.sbs.arizona.edu/sandiway/sudoku/examples.html - Vegard Hanssen puzzle 2155141
+    'example4': '...6..4..7....36......91.8...........5.18...3...3.6.45.4.2...6.9.3.......2....1..',
+    # http://elmo.sbs.arizona.edu/sandiway/sudoku/examples.html - Challenge 2 from Sudoku Solver by Logic
+    'example5': '2..3.....8.4.62..3.138..2......2.39.5.7...621.32..6....2...914.6.125.8.9.....1..2',
+    'wikipedia': '53..7....6..195....98....6.8...6...34..8.3..17...2...6.6....28....419..5....8..79',
+    'singles-and-more': '..9748...7.........2.1.9.....7...24..64.1.59..98...3.....8.3.2.........6...2759..',
+    'seventeen-clues': '.......1.4.........2...........5.4.7..8...3....1.9....3..4..2...5.1........8.6...',
+    'ai-escargot': '1....7.9..3..2...8..96..5....53..9...1..8...26....4...3......1..4......7..7...3..',
+    'inkala-2012': '8..........36......7..9.2...5...7.......457.....1...3...1....68..85...1..9....4..',
+    'norvig-hard1': '4.....8.5.3..........7......2.....6.....8.4......1.......6.3.7.5..2.....1.4......',
+    'norvig-hardest': '..53.....8......2..7..1.5..4....53...1..7...6..32...8..6.5....9..4....3......97..',
+    # Hard puzzles are rare among those `generator` makes, about one in a thousand, so some it has made are kept here,
+    # named after the seed `generator.generate_puzzle` makes them from
+    'generated-1:898': '...419....6....3...825...9.8.19...7...........7...64.9.4...728...6....3....391...',
+    'generated-1:1399': '..2..14.6..84.715........7.5..7.....4.3...5.7.....4..1.3........749.36..1.58..2..',
+    'generated-1:2078': '........2.6...215.....8534.....49..7.4.....3.5..26.....1975.....268...7.7........',
+    'generated-2:39': '........85.7.9..63.3....47....6.9..14.9...2.63..8.2....62....4.14..7.6.57........',
+    'generated-2:40': '.8.1..6..3.5.9..1..2...5...5...7....8..5.4..9....2...6...6...3..9..1.2.5..3..8.9.',
+    'generated-2:984': '..6..2....3..4....85.6.7....7..3...44.3...8.99...1..7....9.8.51....2..6....5..7..',
+    'generated-2:992': '..2..76..78..62..3..98.......3....6..4..1..5..6....3.......65..3..29..47..85..2..',
+}
+
+
+@lru_cache(maxsize=None)
+def graded_puzzles() -> Dict[str, Dict[str, str]]:
+    """The hand picked puzzles of each grade, by name, as `generator.grade` grades them"""
+    from generator import grade
+    graded: Dict[str, Dict[str, str]] = {puzzle_grade: {} for puzzle_grade in GRADES}
+    for name, puzzle in PUZZLES.items():
+        graded[grade(puzzle)][name] = puzzle
+    return graded
+
+
+def random_equivalent(puzzle: str, rng: random.Random, block_height: int=3, block_width: int=3) -> str:
+    """A random relabelling, reordering and (for square blocks) transposition of the puzzle"""
+    size = round(len(puzzle) ** 0.5)
+    labels = list(range(1, size + 1))
+    rng.shuffle(labels)
+    transform = Transform(
+        block_height == block_width and rng.random() < 0.5,
+        random_group_order(size, block_height, rng),
+        random_group_order(size, block_width, rng),
+        tuple([0] + labels),
+    )
+    return to_puzzle(transform.apply(to_values(puzzle)))
+
+
+def graded_corpus(count: int=0, seed: int=0, *, grades: Sequence[str]=GRADES, distinct: int=DISTINCT,
+                  workers: Optional[int]=None) -> Dict[str, List[str]]:
+    """The puzzles of each of `grades`, padded out to `count` puzzles if there are fewer
+
+    A grade without `distinct` hand picked puzzles (or `count`, if fewer) has puzzles generated for it until it has,
+    across `workers` processes, and then random equivalents of them all make up the rest. The same `seed` always gives
+    the same corpus, so results can be compared between runs.
+    """
+    from generator import generate_many
+    corpus = {}
+    for grade in grades:
+        # Each grade has its own, so that it comes out the same whichever other grades are asked for
+        rng = random.Random(f'{seed}:{grade}')
+        puzzles = list(graded_puzzles()[grade].values())
+        wanted = min(count, distinct) - len(puzzles)
+        if wanted > 0:
+            puzzles.extend(generated.puzzle for generated in
+                           generate_many(wanted, seed=seed, workers=workers, grade_wanted=grade))
+        base = list(puzzles)
+        while len(puzzles) < count:
+            puzzles.append(random_equivalent(rng.choice(base), rng))
+        corpus[grade] = puzzles
+    return corpus
@@ -0,0 +1,197 @@
+from time import monotonic
+from typing import Iterator, List, Optional, Tuple
+
+from grid import BoxGrid, Coordinate, full_mask, values_of
+from solver import SolveLimitException, UnsolvableException
+
+
+class DancingLinksSolver:
+    """Solves a BoxGrid as an exact cover problem, using Knuth's Dancing Links (Algorithm X)
+
+    Each (box, value) pair is a row of the matrix, covering four constraints: the box is filled, and the value appears
+    in the box's row, column and block. Unlike `SudokuSolver` there are no heuristics to wander through, so the worst case
+    is predictable, if rarely as quick on puzzles the heuristics can handle on their own.
+    """
+
+    def __init__(self, grid: BoxGrid):
+        assert grid.height == grid.width, "Exact cover needs as many values as there are boxes in a row"
+        self.grid = grid
+        # How many rows of the matrix were tried, and how many of those had to be taken back
+        self.nodes = 0
+        self.backtracks = 0
+        # When to give up, as with `SudokuSolver.solve`
+        self.deadline: Optional[float] = None
+        self.max_nodes: Optional[int] = None
+        self._build()
+
+    def _build(self):
+        grid = self.grid
+        size = grid.width
+        cells = size * size
+        index = grid.index
+        n_columns = 4 * cells
+
+        # Node 0 is the root, nodes 1..n_columns are the column headers, and the matrix rows follow
+        self.L = L = [i - 1 for i in range(n_columns + 1)]
+        self.R = R = [i + 1 for i in range(n_columns + 1)]
+        L[0], R[n_columns] = n_columns, 0
+        self.U = U = list(range(n_columns + 1))
+        self.D = D = list(range(n_columns + 1))
+        self.C = C = list(range(n_columns + 1))
+        self.S = [0] * (n_columns + 1)
+        # For each node, the (coordinates, value) of the matrix row it belongs to
+        self.row_of: List[Tuple[Coordinate, int]] = [None] * (n_columns + 1)
+        self._givens: List[int] = []
+
+        for column in grid.columns:
+            for box in column:
+                if box.coords is None:
+                    raise ValueError("Boxes must know their coordinates to be solved with dancing links")
+                x, y = box.coords
+                block_n = index.block_number((x, y))
+                mask = 1 << box.value if box.is_filled else box.mask & full_mask(size)
+                for value in values_of(mask):
+                    v = value - 1
+                    first = self._add_row(((x, y), value), (
+                        1 + y * size + x,
+                        1 + cells + y * size + v,
+                        1 + 2 * cells + x * size + v,
+                        1 + 3 * cells + block_n * size + v,
+                    ))
+                    if box.is_filled:
+                        self._givens.append(first)
+
+    def _add_row(self, row: Tuple[Coordinate, int], columns: Tuple[int, ...]) -> int:
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        first = len(L)
+        for offset, c in enumerate(columns):
+            node = first + offset
+            L.append(node - 1 if offset else first + len(columns) - 1)
+            R.append(node + 1 if offset < len(columns) - 1 else first)
+            U.append(U[c])
+            D.append(c)
+            C.append(c)
+            D[U[c]] = node
+            U[c] = node
+            S[c] += 1
+            self.row_of.append(row)
+        return first
+
+    def _cover(self, c: int):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        L[R[c]] = L[c]
+        R[L[c]] = R[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                U[D[j]] = U[j]
+                D[U[j]] = D[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def _uncover(self, c: int):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                U[D[j]] = j
+                D[U[j]] = j
+                j = L[j]
+            i = U[i]
+        L[R[c]] = c
+        R[L[c]] = c
+
+    def _select(self, r: int):
+        """Cover the rest of the columns of the row holding node `r`"""
+        R, C = self.R, self.C
+        j = R[r]
+        while j != r:
+            self._cover(C[j])
+            j = R[j]
+
+    def _deselect(self, r: int):
+        L, C = self.L, self.C
+        j = L[r]
+        while j != r:
+            self._uncover(C[j])
+            j = L[j]
+
+    def _take_givens(self):
+        """Cover the columns of every filled box up front, as they are not up for debate"""
+        R, C = self.R, self.C
+        for r in self._givens:
+            # If any column of the given has already been covered, another given has claimed it
+            j = r
+            while True:
+                c = C[j]
+                if self.R[self.L[c]] != c:
+                    raise UnsolvableException(
+                        f"The box at {self.row_of[r][0]} holds {self.row_of[r][1]}, which clashes with another box"
+                    )
+                self._cover(c)
+                j = R[j]
+                if j == r:
+                    break
+
+    def solutions(self) -> Iterator[List[int]]:
+        """Yield the matrix rows (as nodes) chosen for each exact cover, not including the givens
+
+        The yielded list is reused by the search, so it should be consumed before asking for the next solution.
+        """
+        L, R, D, C, S = self.L, self.R, self.D, self.C, self.S
+        deadline, max_nodes = self.deadline, self.max_nodes
+        chosen: List[int] = []
+        while True:
+            if R[0] == 0:
+                yield chosen
+                if not chosen:
+                    return
+                r = chosen.pop()
+                c = C[r]
+                self._deselect(r)
+                r = D[r]
+            else:
+                # Branch on the column with the fewest rows left
+                c, size = R[0], S[R[0]]
+                j = R[c]
+                while j and size:
+                    if S[j] < size:
+                        c, size = j, S[j]
+                    j = R[j]
+                self._cover(c)
+                r = D[c]
+
+            while r == c:
+                self._uncover(c)
+                if not chosen:
+                    return
+                self.backtracks += 1
+                r = chosen.pop()
+                c = C[r]
+                self._deselect(r)
+                r = D[r]
+
+            if max_nodes is not None and self.nodes >= max_nodes:
+                raise SolveLimitException(f"Gave up after {self.nodes} guesses", self.grid, self.nodes, self.backtracks)
+            if deadline is not None and monotonic() >= deadline:
+                raise SolveLimitException(f"Gave up as the deadline passed, having made {self.nodes} guesses",
+                                          self.grid, self.nodes, self.backtracks)
+            self.nodes += 1
+            chosen.append(r)
+            self._select(r)
+
+    def solve(self, *, deadline: float=None, max_nodes: int=None):
+        """Solve the grid in place, giving up as `SudokuSolver.solve` does at the deadline or after `max_nodes` rows"""
+        self.deadline, self.max_nodes = deadline, max_nodes
+        self._take_givens()
+        for chosen in self.solutions():
+            for r in chosen:
+                coords, value = self.row_of[r]
+                self.grid[coords].value = value
+            return
+        raise UnsolvableException("There is no way to fill the grid so that every value appears once in every array")
+
@@ -0,0 +1,44 @@
+from time import perf_counter
+from typing import Dict, Iterable, Type
+
+from dlx import DancingLinksSolver
+from grid import BoxGrid
+from parallel import ParallelSolver
+from solver import SudokuSolver
+
+# Every way of solving a grid, by the name callers can ask for it by
+ENGINES: Dict[str, Type] = {
+    'heuristic': SudokuSolver,
+    'dlx': DancingLinksSolver,
+    'parallel': ParallelSolver,
+}
+
+
+def get_solver(grid: BoxGrid, engine: str='heuristic', **options):
+    """Build the solver for `grid` using the named engine, passing on any engine specific options"""
+    try:
+        engine_class = ENGINES[engine]
+    except KeyError:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}") from None
+    return engine_class(grid, **options)
+
+
+def solve(grid: BoxGrid, *, engine: str='heuristic', deadline: float=None, max_nodes: int=None, **options):
+    """Solve `grid` in place with the named engine, returning the solver used
+
+    `deadline` and `max_nodes` limit the solve as described in `SudokuSolver.solve`.
+    """
+    solver = get_solver(grid, engine, **options)
+    solver.solve(deadline=deadline, max_nodes=max_nodes)
+    return solver
+
+
+def time_engines(grid: BoxGrid, engines: Iterable[str]=ENGINES) -> Dict[str, float]:
+    """Solve a copy of `grid` with each engine, returning how many seconds each took"""
+    timings = {}
+    for engine in engines:
+        solver = get_solver(grid.deep_copy(), engine)
+        start = perf_counter()
+        solver.solve()
+        timings[engine] = perf_counter() - start
+    return timings
@@ -0,0 +1,182 @@
+"""Generation of random puzzles with unique solutions, graded by which steps of the solver they need
+
+    python generator.py --count 1000 --grade hard --seed 1 --workers 4 > puzzles.txt
+
+A puzzle is made by filling an empty grid with a randomised search, then taking clues away in a random order, keeping
+each removal only if the solution stays unique. Everything is driven by a `random.Random` seeded per puzzle, so the
+same seed always gives the same puzzles, however many processes they are spread across.
+"""
+import argparse
+import logging
+import random
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Deque, Iterator, List, NamedTuple, Optional
+
+from cache import to_puzzle, to_values
+from corpus import GRADES
+from grid import BoxGrid
+from solver import RULES, SudokuSolver, UnfinishableException
+
+SINGLES_RULES = ('naked_singles', 'hidden_singles')
+# The rules enough to solve puzzles of each grade, bar 'diabolical' which needs searching
+GRADE_RULES = (
+    ('easy', SINGLES_RULES),
+    ('medium', SINGLES_RULES + ('pointing', 'box_line', 'naked_pairs', 'hidden_pairs')),
+    ('hard', RULES),
+)
+# Checking uniqueness is mostly searching, which is quicker with only the cheaper rules
+UNIQUENESS_RULES = SINGLES_RULES + ('pointing', 'box_line')
+
+
+class GenerationException(Exception): pass
+
+
+class GeneratedPuzzle(NamedTuple):
+    puzzle: str
+    solution: str
+    grade: str
+    # The seed to give `generate_puzzle` to get this puzzle again
+    seed: str
+
+
+def random_solution(rng: random.Random, block_height: int=3, block_width: int=3) -> str:
+    """A random completely filled grid, as from `BoxGrid.to_string`"""
+    size = block_height * block_width
+    grid = BoxGrid.from_string('.' * size * size, block_height=block_height, block_width=block_width)
+    # An empty grid has so many possibilities that most rules only slow the search down, but without hidden singles the
+    # search on larger grids wanders into dead ends it takes far too long to back out of
+    solver = SudokuSolver(grid, rules=SINGLES_RULES)
+    solver.propagate_givens()
+    solver.propagate()
+    for solution in solver.search(rng):
+        return solution.to_string()
+    raise GenerationException(f"Could not fill a {size}x{size} grid")
+
+
+def has_other_solution(values: List[int], position: int, value: int, block_height: int, block_width: int) -> bool:
+    """Whether the puzzle would have another solution if the clue at `position` (which holds `value`) were taken away
+
+    The puzzle is unique before the removal, so any other solution has something else at `position`. Ruling `value`
+    out there and looking for any solution at all is much quicker than counting solutions, as it is usually refuted by
+    propagation alone.
+    """
+    size = block_height * block_width
+    grid = BoxGrid.from_string(to_puzzle(values[:position] + [0] + values[position + 1:]),
+                               block_height=block_height, block_width=block_width)
+    box = grid[position % size, position // size]
+    box.mask &= ~(1 << value)
+    solver = SudokuSolver(grid, rules=UNIQUENESS_RULES)
+    return solver.count_solutions(limit=1) > 0
+
+
+def remove_clues(solution: str, rng: random.Random, block_height: int=3, block_width: int=3,
+                 symmetric: bool=True) -> str:
+    """Take away clues from a solution, in a random order, for as long as the solution stays unique
+
+    With `symmetric`, clues are taken away in pairs mirrored through the centre, as is traditional, so a few more
+    clues may be left than strictly needed.
+    """
+    values = to_values(solution)
+    cells = len(values)
+    positions = list(range(cells))
+    rng.shuffle(positions)
+    for position in positions:
+        group = {position, cells - 1 - position} if symmetric else {position}
+        reduced = list(values)
+        for p in sorted(group):
+            if not reduced[p]:
+                continue
+            if has_other_solution(reduced, p, reduced[p], block_height, block_width):
+                break
+            reduced[p] = 0
+        else:
+            values = reduced
+    return to_puzzle(values)
+
+
+def grade(puzzle: str, block_height: int=3, block_width: int=3) -> str:
+    """How hard the puzzle is, as one of `corpus.GRADES`, by which of the solver's rules it needs
+
+    'easy' puzzles can be finished with just naked and hidden singles, 'medium' ones also need the intersection rules or
+    pairs, 'hard' ones need triples or quads too, and 'diabolical' ones can't be finished without the emergency search.
+    """
+    for puzzle_grade, rules in GRADE_RULES:
+        grid = BoxGrid.from_string(puzzle, block_height=block_height, block_width=block_width)
+        try:
+            SudokuSolver(grid, max_emergency_depth=0, rules=rules).solve()
+        except UnfinishableException:
+            continue
+        return puzzle_grade
+    return 'diabolical'
+
+
+def generate_puzzle(seed: str, *, grade_wanted: Optional[str]=None, block_height: int=3, block_width: int=3,
+                    symmetric: bool=True, attempts: int=200) -> GeneratedPuzzle:
+    """Generate a puzzle from `seed`, trying up to `attempts` times to get one of `grade_wanted` if given"""
+    if grade_wanted is not None and grade_wanted not in GRADES:
+        raise ValueError(f"Unknown grade {grade_wanted!r}, expected one of {', '.join(GRADES)}")
+    rng = random.Random(seed)
+    for _ in range(attempts):
+        solution = random_solution(rng, block_height, block_width)
+        puzzle = remove_clues(solution, rng, block_height, block_width, symmetric)
+        puzzle_grade = grade(puzzle, block_height, block_width)
+        if grade_wanted is None or puzzle_grade == grade_wanted:
+            return GeneratedPuzzle(puzzle, solution, puzzle_grade, seed)
+    raise GenerationException(f"No {grade_wanted} puzzle found in {attempts} attempts from seed {seed!r}")
+
+
+def generate_chunk(seeds: List[str], options: dict) -> List[GeneratedPuzzle]:
+    return [generate_puzzle(seed, **options) for seed in seeds]
+
+
+def generate_many(count: int, *, seed: int=0, workers: Optional[int]=None, chunksize: int=8,
+                  **options) -> Iterator[GeneratedPuzzle]:
+    """Generate `count` puzzles across a pool of processes, yielding them in order
+
+    Puzzle n is generated from the seed f'{seed}:{n}', so the output depends only on `seed` and not on `workers`.
+    Any `options` are passed on to `generate_puzzle`. With a single worker everything is generated in this process.
+    """
+    seeds = (f'{seed}:{n}' for n in range(count))
+    chunks = iter(lambda: list(islice(seeds, chunksize)), [])
+    if workers == 1:
+        for chunk in chunks:
+            yield from generate_chunk(chunk, options)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # As in `batch.solve_many`, only keep a few chunks per worker in flight
+        max_in_flight = 4 * executor._max_workers
+        in_order: Deque[Future] = deque(executor.submit(generate_chunk, chunk, options)
+                                        for chunk in islice(chunks, max_in_flight))
+        while in_order:
+            results = in_order.popleft().result()
+            for chunk in islice(chunks, 1):
+                in_order.append(executor.submit(generate_chunk, chunk, options))
+            yield from results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate puzzles with unique solutions, one per line")
+    parser.add_argument('--count', type=int, default=1, help="number of puzzles to generate")
+    parser.add_argument('--seed', type=int, default=0, help="seed to generate from, the same seed gives the same puzzles")
+    parser.add_argument('--grade', choices=GRADES, help="only give puzzles of this grade")
+    parser.add_argument('--block-height', type=int, default=3)
+    parser.add_argument('--block-width', type=int, default=3)
+    parser.add_argument('--asymmetric', action='store_true', help="don't keep the clues symmetric")
+    parser.add_argument('--workers', type=int, default=1, help="number of processes to generate with")
+    parser.add_argument('--with-grade', action='store_true', help="follow each puzzle with its grade")
+    args = parser.parse_args(argv)
+    logging.getLogger('solver').setLevel(logging.ERROR)
+
+    for generated in generate_many(args.count, seed=args.seed, workers=args.workers, grade_wanted=args.grade,
+                                   block_height=args.block_height, block_width=args.block_width,
+                                   symmetric=not args.asymmetric):
+        print(f'{generated.puzzle} {generated.grade}' if args.with_grade else generated.puzzle)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,100 @@
-from typing import Set, List, Tuple, Union, Iterable, Callable, Iterator, Optional
+from typing import Dict, FrozenSet, List, NamedTuple, Tuple, Union, Iterable, Callable, Iterator, Optional
 import math as maths
+from functools import lru_cache
 
 
 Coordinate = Tuple[int, int]
 Position = Union[Coordinate, int]
 
+# How each value is written when a grid is turned into a string, value n being SYMBOLS[n-1]
+SYMBOLS = '123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
 class BoxNotSolvedException(Exception): pass
 
+
+if hasattr(int, 'bit_count'):
+    popcount: Callable[[int], int] = int.bit_count
+else:
+    def popcount(mask: int) -> int:
+        """The number of candidates held in a candidate bitmask"""
+        return bin(mask).count('1')
+
+
+def lowest_bit(mask: int) -> int:
+    """Isolate the lowest set bit of a candidate bitmask"""
+    return mask & -mask
+
+
+def bit_value(bit: int) -> int:
+    """The value represented by a single-bit mask"""
+    return bit.bit_length() - 1
+
+
+def mask_of(values: Iterable[int]) -> int:
+    """Build a candidate bitmask, where bit n is set if n is a candidate"""
+    mask = 0
+    for n in values:
+        mask |= 1 << n
+    return mask
+
+
+def values_of(mask: int) -> Iterator[int]:
+    """Yield the values held in a candidate bitmask, smallest first"""
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
+
+
+def full_mask(size: int) -> int:
+    """The candidate bitmask holding every value from 1 to `size`"""
+    return ((1 << size) - 1) << 1
+
+
+def block_shape(size: int) -> Tuple[int, int]:
+    """The usual (block_height, block_width) for a grid of `size` by `size`, the blocks being as square as they can be
+
+    e.g. 3x3 blocks for 9x9 grids, 2x3 for 6x6 grids and 3x4 for 12x12 grids.
+    """
+    block_height = int(maths.sqrt(size))
+    while size % block_height:
+        block_height -= 1
+    return block_height, size // block_height
+
+
 class Box:
-    _value: int
-    possible_values: Set[int]
+    """A single cell of the grid
+
+    Candidates are held as a bitmask in `mask`, where bit n is set if n is still possible. `possible_values` is kept as a
+    read-only view of the same information for convenience, but anything hot should use `mask` directly.
+    """
+    __slots__ = ('_value', 'mask', 'coords')
+
+    _value: Optional[int]
+    mask: int
     coords: Optional[Coordinate]
 
-    def __init__(self, value: int=None, possible_values: Set[int]=None, *, coords: Coordinate=None):
-        self.possible_values = possible_values if possible_values is not None else {n+1 for n in range(9)}
+    def __init__(self, value: int=None, possible_values: Iterable[int]=None, *, coords: Coordinate=None, mask: int=None,
+                 size: int=9):
+        if mask is None:
+            mask = mask_of(possible_values) if possible_values is not None else full_mask(size)
+        self.mask = mask
         self._value = value
         self.coords = coords
 
+    @property
+    def possible_values(self) -> FrozenSet[int]:
+        return frozenset(values_of(self.mask))
+
+    @property
+    def candidate_count(self) -> int:
+        return popcount(self.mask)
+
+    def has_candidate(self, n: int) -> bool:
+        return not not self.mask >> n & 1
+
     def clear_possible_values(self):
-        self.possible_values &= set()
+        self.mask = 0
 
     @property
     def value(self) -> int:
@@ -26,32 +102,104 @@ class Box:
 
     @value.setter
     def value(self, n: int):
-        assert n in self.possible_values, f'Invalid value of n, {n}, provided for {self!r}'
-        self.clear_possible_values()
+        assert self.mask >> n & 1, f'Invalid value of n, {n}, provided for {self!r}'
+        self.mask = 0
         self._value = n
 
     def __repr__(self):
-        return f"{self.__class__.__name__}({self.value}, {self.possible_values}, coords={self.coords})"
+        return f"{self.__class__.__name__}({self.value}, {set(values_of(self.mask))}, coords={self.coords})"
 
     def finalise(self) -> int:
         """Make the only remaining possible value the value"""
-        assert len(self.possible_values) == 1, BoxNotSolvedException
-        self.value, = self.possible_values
+        assert self.mask and not self.mask & (self.mask - 1), BoxNotSolvedException
+        self.value = bit_value(self.mask)
         return self.value
 
     @property
     def is_filled(self):
-        return not not self.value
+        return not not self._value
 
     def copy(self):
-        return self.__class__(self._value, set(self.possible_values), coords=self.coords)
+        return self.__class__(self._value, coords=self.coords, mask=self.mask)
 
     def __eq__(self, other):
-        return isinstance(other, Box) and self.value == other.value and self.possible_values == other.possible_values
+        return isinstance(other, Box) and self._value == other._value and self.mask == other.mask
 
 
 Column = List[Box]
 Row = List[Box]
+Unit = Tuple[Coordinate, ...]
+
+
+class UnitIndex:
+    """The rows, columns and blocks (together, the 'units') of a grid geometry, along with which units and peers each cell has
+
+    This only depends on the dimensions of the grid, so it is built once per geometry by `unit_index` and shared between
+    every grid of that shape. Units are numbered columns first, then rows, and then blocks, the same order as
+    `BoxGrid.all_arrays`.
+    """
+    __slots__ = ('height', 'width', 'block_height', 'block_width', 'columns', 'rows', 'blocks', 'units',
+                 'cell_units', 'peers')
+
+    def __init__(self, height: int, width: int, block_height: int, block_width: int):
+        self.height = height
+        self.width = width
+        self.block_height = block_height
+        self.block_width = block_width
+
+        self.columns: Tuple[Unit, ...] = tuple(tuple((x, y) for y in range(height)) for x in range(width))
+        self.rows: Tuple[Unit, ...] = tuple(tuple((x, y) for x in range(width)) for y in range(height))
+
+        blocks_tall = maths.ceil(height / block_height)
+        blocks_wide = maths.ceil(width / block_width)
+        blocks = [[] for _ in range(blocks_tall * blocks_wide)]
+        for x in range(width):
+            for y in range(height):
+                blocks[self.block_number((x, y))].append((x, y))
+        self.blocks: Tuple[Unit, ...] = tuple(tuple(block) for block in blocks)
+
+        self.units: Tuple[Unit, ...] = self.columns + self.rows + self.blocks
+
+        # For each cell, the unit numbers of its row, column and block
+        self.cell_units: Dict[Coordinate, Tuple[int, int, int]] = {
+            (x, y): (width + y, x, width + height + self.block_number((x, y)))
+            for x in range(width) for y in range(height)
+        }
+        # For each cell, every other cell which shares a unit with it
+        self.peers: Dict[Coordinate, Unit] = {
+            cell: tuple(sorted({peer for n in units for peer in self.units[n]} - {cell}))
+            for cell, units in self.cell_units.items()
+        }
+
+    def block_number(self, position: Coordinate) -> int:
+        x, y = position
+        blocks_tall = maths.ceil(self.height / self.block_height)
+        return (blocks_tall * (x // self.block_width)) + (y // self.block_height)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}({self.height}, {self.width}, "
+                f"block_height={self.block_height}, block_width={self.block_width})")
+
+
+@lru_cache(maxsize=None)
+def unit_index(height: int, width: int, block_height: int, block_width: int) -> UnitIndex:
+    """Get the shared `UnitIndex` for a grid geometry, building it the first time it is asked for"""
+    return UnitIndex(height, width, block_height, block_width)
+
+
+class GridSnapshot(NamedTuple):
+    """The state of every box of a grid at some point, row by row, which grids can be built from or put back to
+
+    Being a few tuples of ints rather than a `Box` per box, a snapshot is cheap to take, small to pickle, and never
+    changes, so it can be shared between solvers (or kept for as long as needed) without being copied.
+    """
+    block_height: int
+    block_width: int
+    # The value of each box, 0 if it is empty
+    values: Tuple[int, ...]
+    # The candidate bitmask of each box, as `Box.mask`
+    masks: Tuple[int, ...]
+
 
 class BoxGrid:
     block_height: int = 3
@@ -71,6 +219,7 @@ class BoxGrid:
                 for column in base:
                     assert isinstance(column, Iterable), "Given iterable must be Iterable[Iterable]"
                     self.columns.append(list(column))
+                self._set_block_shape(len(self.columns), kwargs)
         else:
             if len(args) == 2:
                 height = args[0]
@@ -84,10 +233,25 @@ class BoxGrid:
             height = kwargs.get('height', height)
             width = kwargs.get('width', width)
 
-            self.columns = [[Box(coords=(x, y)) for y in range(height)] for x in range(width)]
+            self._set_block_shape(height, kwargs)
+            mask = full_mask(self.size)
+            self.columns = [[Box(coords=(x, y), mask=mask) for y in range(height)] for x in range(width)]
+
+    def _set_block_shape(self, size: int, kwargs: dict):
+        """Take the block dimensions from `kwargs`, working out whichever are missing from the grid's `size`"""
+        block_height, block_width = kwargs.get('block_height'), kwargs.get('block_width')
+        if block_height is None and block_width is None:
+            block_height, block_width = block_shape(size)
+        elif block_height is None:
+            block_height = size // block_width
+        elif block_width is None:
+            block_width = size // block_height
+        self.block_height, self.block_width = block_height, block_width
 
-        self.block_height = kwargs.get('block_height', self.block_height)
-        self.block_width = kwargs.get('block_width', self.block_width)
+    @property
+    def size(self) -> int:
+        """The number of values each box can take, which is also the number of boxes in each unit"""
+        return self.block_height * self.block_width
 
     @property
     def height(self) -> int:
@@ -97,13 +261,14 @@ class BoxGrid:
     def width(self) -> int:
         return len(self.columns)
 
+    @property
+    def index(self) -> UnitIndex:
+        return unit_index(self.height, self.width, self.block_height, self.block_width)
+
     @property
     def rows(self) -> List[Row]:
-        rows = [[] for _ in range(self.height)]
-        for column in self.columns:
-            for n, value in enumerate(column):
-                rows[n].append(value)
-        return rows
+        columns = self.columns
+        return [[columns[x][y] for x, y in row] for row in self.index.rows]
 
     def get_rows(self) -> List[Row]:
         return self.rows
@@ -112,21 +277,18 @@ class BoxGrid:
         return self.columns
 
     def get_blocks(self) -> List[List[Box]]:
-        blocks = []
-        block_n = 0
-        for col_n, column in enumerate(self.columns):
-            for row_n, box in enumerate(column):
-                try:
-                    blocks[block_n].append(box)
-                except IndexError:
-                    blocks.append([box])
-                if not (row_n + 1) % self.block_height:
-                    block_n += 1
-            if not (col_n + 1) % self.block_width:
-                pass #block_n += 1
-            else:
-                block_n -= self.height // self.block_height
-        return blocks
+        columns = self.columns
+        return [[columns[x][y] for x, y in block] for block in self.index.blocks]
+
+    def get_unit(self, n: int) -> List[Box]:
+        """Get the boxes of unit number `n`, as numbered by `UnitIndex`"""
+        columns = self.columns
+        return [columns[x][y] for x, y in self.index.units[n]]
+
+    def get_peers(self, position: Coordinate) -> List[Box]:
+        """Get every box which shares a row, column or block with the given position"""
+        columns = self.columns
+        return [columns[x][y] for x, y in self.index.peers[position]]
 
     def __str__(self):
         build_str = ""
@@ -137,6 +299,31 @@ class BoxGrid:
     def __repr__(self):
         return f"{self.__class__.__name__}({self.columns}, block_height={self.block_height}, block_width={self.block_width})"
 
+    @classmethod
+    def from_string(cls, puzzle: str, **kwargs) -> 'BoxGrid':
+        """Build a grid from a puzzle written out row by row, with '.' or '0' for empty boxes
+
+        e.g. '53..7....6..195....98....6.8...6...34..8.3..17...2...6.6....28....419..5....8..79' for a 9x9 puzzle.
+        Values over 9, for larger grids, are written as letters, so 10 is 'A', 16 is 'G' and so on (see `SYMBOLS`).
+        """
+        puzzle = puzzle.strip()
+        size = round(maths.sqrt(len(puzzle)))
+        if size * size != len(puzzle):
+            raise ValueError(f"A puzzle of {len(puzzle)} boxes cannot be made into a square grid")
+        grid = cls(size, size, **kwargs)
+        for n, symbol in enumerate(puzzle):
+            if symbol in '.0':
+                continue
+            value = SYMBOLS.find(symbol.upper()) + 1
+            if not 0 < value <= size:
+                raise ValueError(f"Unexpected {symbol!r} found in puzzle, at position {n}")
+            grid[n % size, n // size].value = value
+        return grid
+
+    def to_string(self) -> str:
+        """Write the grid out row by row, as read by `from_string`"""
+        return ''.join(SYMBOLS[box.value - 1] if box.value else '.' for row in self.rows for box in row)
+
     def __getitem__(self, position: Position):
         if isinstance(position, int):
             return self.columns[position]
@@ -166,22 +353,29 @@ class BoxGrid:
         yield from self.get_all_arrays()
 
     def get_containing_array_functions(self, position: Coordinate) -> Iterator[Callable[[], List[Box]]]:
-        x, y = position
-        blocks_tall = maths.ceil(self.height / self.block_height)
-        block_n = (blocks_tall * (x // self.block_width)) + (y//self.block_height)
-        yield from (lambda: self.rows[y],
-                    lambda: self.columns[x],
-                    lambda: self.get_blocks()[block_n]
+        row_n, column_n, block_n = self.index.cell_units[position]
+        yield from (lambda: self.get_unit(row_n),
+                    lambda: self.get_unit(column_n),
+                    lambda: self.get_unit(block_n)
                     )
 
     def get_containing_arrays(self, position: Coordinate):
-        for array_f in self.get_containing_array_functions(position):
-            yield array_f()
+        for n in self.index.cell_units[position]:
+            yield self.get_unit(n)
 
     @staticmethod
     def box_values(iter_of_boxes: Iterable[Box]) -> Iterable[Optional[int]]:
         return iter_of_boxes.__class__(x.value for x in iter_of_boxes)
 
+    @staticmethod
+    def value_mask(iter_of_boxes: Iterable[Box]) -> int:
+        """The bitmask of every value already placed in the boxes"""
+        mask = 0
+        for box in iter_of_boxes:
+            if box._value:
+                mask |= 1 << box._value
+        return mask
+
     @staticmethod
     def completed_box_values(iter_of_boxes: Iterable[Box]) -> Iterable[Optional[int]]:
         return iter_of_boxes.__class__(x.value for x in iter_of_boxes if x.value is not None)
@@ -191,25 +385,53 @@ class BoxGrid:
             for y, box in enumerate(column):
                 box.coords = (x, y)
 
+    def snapshot(self) -> GridSnapshot:
+        """Take an immutable snapshot of every box's value and candidates"""
+        boxes = [column[y] for y in range(self.height) for column in self.columns]
+        return GridSnapshot(self.block_height, self.block_width, tuple(box._value or 0 for box in boxes),
+                            tuple(box.mask for box in boxes))
+
+    def restore(self, snapshot: GridSnapshot):
+        """Put every box back as it was in the snapshot, reusing the boxes rather than making new ones"""
+        if (snapshot.block_height, snapshot.block_width) != (self.block_height, self.block_width) \
+                or len(snapshot.values) != self.height * self.width:
+            raise ValueError("The snapshot is of a grid of a different shape")
+        width = self.width
+        for n, (value, mask) in enumerate(zip(snapshot.values, snapshot.masks)):
+            box = self.columns[n % width][n // width]
+            box._value = value or None
+            box.mask = mask
+
+    @classmethod
+    def from_snapshot(cls, snapshot: GridSnapshot) -> 'BoxGrid':
+        size = snapshot.block_height * snapshot.block_width
+        grid = cls(size, size, block_height=snapshot.block_height, block_width=snapshot.block_width)
+        grid.restore(snapshot)
+        return grid
+
     def deep_copy(self):
-        return BoxGrid([[box.copy() for box in column] for column in self.columns])
+        return BoxGrid([[box.copy() for box in column] for column in self.columns],
+                       block_height=self.block_height, block_width=self.block_width)
 
     def check_complete(self):
-        for row in self.rows:
-            for box in row:
-                if box.possible_values:
+        for column in self.columns:
+            for box in column:
+                if box.mask:
                     return False
         return True
 
     def check_errors(self):
-        for arrays in self.all_arrays:
-            for array in arrays:
-                completed_box_values = self.completed_box_values(array)
-                if len(tuple(completed_box_values)) != len(set(completed_box_values)):
-                    return True
+        columns = self.columns
+        for unit in self.index.units:
+            seen = 0
+            for x, y in unit:
+                value = columns[x][y]._value
+                if value:
+                    if seen >> value & 1:
+                        return True
+                    seen |= 1 << value
         return False
 
-
     def __eq__(self, other):
         if not isinstance(other, BoxGrid):
             return False
@@ -1,5 +1,5 @@
 from grid import BoxGrid
-from solver import SudokuSolver
+from solver import SudokuSolver, UnsolvableException
 
 
 class SolverInterface:
@@ -18,13 +18,19 @@ The main menu allows you to access:
 To input a puzzle, just enter the value of
 the box it is indicating. If input
 something invalid, it will reprompt you.
+Each value is checked against everything
+entered so far as soon as it goes in, and
+any boxes it forces are filled in and
+shown (in [brackets] when you reach them).
 
 Input rules:
     "sN" (where N is an integer)
       - Skip N boxes (including the current
         and last)
-    "<" - Move back one, and reinput
-    "<N" - Move back N and reinput
+    "<" - Move back one, taking back what
+          was entered there, and reinput
+    "<N" - Move back N, taking back what
+           was entered, and reinput
     "N" - Input n in the current box
     "" - If you input nothing, it will leave
          that box empty, and move on to the
@@ -46,26 +52,36 @@ Input rules:
     def help(self):
         print(self.help_message)
 
-    def input_grid(self):
-        grid = BoxGrid()
+    def input_size(self) -> int:
+        while True:
+            e = input(f'Size of grid, blank for 9 {self.prompt} ') or '9'
+            if e.isdigit() and int(e) > 0:
+                return int(e)
+
+    def input_grid(self, size: int=9) -> SudokuSolver:
+        """Read a puzzle in a box at a time, returning a solver which has propagated everything put in so far"""
+        solver = SudokuSolver(BoxGrid(size, size))
+        solver.start()
+        grid = solver.grid
 
         y = 0
-        while y < 9:
+        while y < size:
             x = 0
-            while x < 9 and y < 9:
-                e = input(f'{x+1, y+1} {self.prompt} ') or 's1'
+            while x < size and y < size:
+                filled = f' [{grid[x, y].value}]' if grid[x, y].is_filled else ''
+                e = input(f'{x+1, y+1}{filled} {self.prompt} ') or 's1'
                 try:
-                    if e.isdigit() and int(e) in grid[x, y].possible_values:
-                        try:
-                            grid[x, y].value = int(e)
-                        except AssertionError:
-                            grid[x, y].possible_values = set(range(1, 10))
-                            grid[x, y].value = int(e)
+                    if e.isdigit():
+                        forced = solver.enter((x, y), int(e))
+                        if forced:
+                            # Shown as numbers, just as values are typed in and shown in the prompt, even past 9
+                            print('Forced:', ', '.join(f'{box.coords[0]+1, box.coords[1]+1}={box.value}'
+                                                       for box in forced))
                         x += 1
                     elif e.startswith('s'):
                         x += int(e.lstrip('s'))
-                        while x > 8:
-                            x -= 9
+                        while x >= size:
+                            x -= size
                             y += 1
                             print('---')
                     elif e.startswith('<'):
@@ -74,20 +90,25 @@ Input rules:
                         else:
                             x -= int(e.lstrip('<'))
                         while x < 0:
-                            x += 9
+                            x += size
                             y -= 1
                             print('^^^')
+                        # Everything entered from here on is taken back, along with whatever it forced
+                        while solver.entered and solver.entered[-1].coords[::-1] >= (y, x):
+                            solver.take_back()
+                except UnsolvableException as e:
+                    print(f'That clashes with what is already there! ({e})')
                 except Exception as e:
                     print(f'Sorry, that didn\'t go to plan! ({e.__class__.__name__})')
             print('---')
             y += 1
-        return grid
+        return solver
 
     def solve(self):
-        grid = self.input_grid()
-        print(grid)
+        solver = self.input_grid(self.input_size())
+        print(solver.grid)
 
-        solver = SudokuSolver(grid)
-        solver.solve()
+        # Everything entered has already been propagated, so this carries on from there
+        solver.finish()
 
-        print('', self.success_message, grid, sep='\n')
+        print('', self.success_message, solver.grid, sep='\n')
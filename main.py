@@ -1,5 +1,93 @@
+import argparse
+import sys
+
 from interface import *
 
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Solve sudoku puzzles, interactively or in bulk")
+    commands = parser.add_subparsers(dest='command')
+
+    solve_parser = commands.add_parser('solve', help="solve puzzles given one per line, writing a solution per line")
+    solve_parser.add_argument('file', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                              help="file of puzzles to solve, read from stdin if not given")
+    solve_parser.add_argument('--engine', default='heuristic', help="which solver engine to use")
+    solve_parser.add_argument('--workers', type=int, default=1, help="number of processes to solve with")
+    solve_parser.add_argument('--chunksize', type=int, default=64, help="puzzles handed to a process at once")
+    solve_parser.add_argument('--vectorize', action='store_true',
+                              help="propagate singles over each chunk at once with NumPy before using the engine")
+    solve_parser.add_argument('--corpus', metavar='PATH',
+                              help="solve the puzzles of a corpus file made by packed.py, rather than of a text file")
+
+    serve_parser = commands.add_parser('serve', help="solve puzzles sent over a socket, see server.py")
+    add_address_arguments(serve_parser)
+    serve_parser.add_argument('--engine', default='heuristic', help="engine used when a request doesn't say")
+    serve_parser.add_argument('--workers', type=int, help="number of processes to solve with (default: one per CPU)")
+    serve_parser.add_argument('--queue-size', type=int, default=256,
+                              help="requests which can wait for a worker before connections stop being read")
+    serve_parser.add_argument('--timeout', type=float, default=10.0,
+                              help="seconds a request may take, whether or not it gives a (shorter) timeout of its own")
+
+    client_parser = commands.add_parser('client', help="solve puzzles given one per line using a running server")
+    client_parser.add_argument('file', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                               help="file of puzzles to solve, read from stdin if not given")
+    add_address_arguments(client_parser)
+    client_parser.add_argument('--engine', help="which solver engine to use (default: the server's)")
+    client_parser.add_argument('--timeout', type=float, help="seconds to allow each puzzle (default: the server's)")
+    client_parser.add_argument('--health', action='store_true', help="print the server's health and exit")
+    client_parser.add_argument('--metrics', action='store_true', help="print the server's metrics and exit")
+
+    return parser.parse_args(argv)
+
+
+def add_address_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help="use a Unix socket at PATH rather than TCP")
+
+
+async def run_client(args: argparse.Namespace) -> int:
+    import json
+    import server
+    if args.health or args.metrics:
+        client = await server.SolveClient.connect(args.host, args.port, args.unix)
+        try:
+            print(json.dumps(await client.request({'command': 'health' if args.health else 'metrics'})))
+        finally:
+            await client.close()
+        return 0
+    options = {name: value for name, value in (('engine', args.engine), ('timeout', args.timeout)) if value is not None}
+    return await server.solve_file(args.file, sys.stdout, sys.stderr, host=args.host, port=args.port, path=args.unix,
+                                   **options)
+
+
 if __name__ == '__main__':
-    interface = SolverInterface()
-    interface.run()
\ No newline at end of file
+    args = parse_args()
+    if args.command == 'solve':
+        import logging
+        import puzzle_io
+        # Don't let a warning for every puzzle needing a search get mixed up with the errors written for failed ones
+        logging.getLogger('solver').setLevel(logging.ERROR)
+        options = dict(engine=args.engine, workers=args.workers, chunksize=args.chunksize, vectorize=args.vectorize)
+        if args.corpus:
+            failures = puzzle_io.solve_corpus_file(args.corpus, sys.stdout, sys.stderr, **options)
+        else:
+            failures = puzzle_io.solve_file(args.file, sys.stdout, sys.stderr, **options)
+        sys.exit(1 if failures else 0)
+    elif args.command == 'serve':
+        import asyncio
+        import logging
+        import server
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+        solve_server = server.SolveServer(workers=args.workers, queue_size=args.queue_size, timeout=args.timeout,
+                                          engine=args.engine)
+        try:
+            asyncio.run(solve_server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == 'client':
+        import asyncio
+        sys.exit(1 if asyncio.run(run_client(args)) else 0)
+    else:
+        interface = SolverInterface()
+        interface.run()
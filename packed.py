@@ -0,0 +1,262 @@
+"""Compact binary forms of grids, and corpus files of them which are read through `mmap`
+
+A puzzle's givens are packed into `value_bits` bits a box, 4 for a 9x9 grid, so it takes 41 bytes rather than the 81
+characters of `BoxGrid.to_string`. A partially solved grid is written as its packed values followed by every box's
+candidate bitmask in a fixed number of bytes.
+
+A corpus file is a header followed by packed puzzles, all the same length, so puzzle i is found by arithmetic alone:
+
+    python packed.py puzzles.txt puzzles.sdk
+
+As the file is mapped rather than read, opening one costs nothing however many puzzles it holds, and every process with
+it open shares the same pages of the OS's cache. `CorpusFile`s pickle as their path, so sending one to a worker process
+only has it opened again there.
+"""
+import mmap
+import os
+import struct
+import sys
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Union
+
+from grid import SYMBOLS, BoxGrid, block_shape
+
+MAGIC = b'SDKP'
+VERSION = 1
+# The magic bytes, the version, the shape of the blocks, and the number of puzzles, padded out to 16 bytes
+HEADER = struct.Struct('<4sBBBxQ')
+
+# The characters of a 9x9 puzzle for each byte of its packed form, two boxes a byte with the first in the low bits
+_PAIRS = [('.' + SYMBOLS)[low] + ('.' + SYMBOLS)[high] if low <= 9 and high <= 9 else '??'
+          for high in range(16) for low in range(16)]
+
+
+def _value_table() -> bytes:
+    """A table for `bytes.translate` turning each character of a puzzle into its value, and anything else into 255"""
+    table = bytearray(b'\xff' * 256)
+    table[ord('.')] = table[ord('0')] = 0
+    for value, symbol in enumerate(SYMBOLS, 1):
+        table[ord(symbol)] = table[ord(symbol.lower())] = value
+    return bytes(table)
+
+
+_VALUES = _value_table()
+
+
+class CorpusFormatException(ValueError): pass
+
+
+def value_bits(size: int) -> int:
+    """The number of bits each box of a `size` by `size` grid takes when packed, enough for 0 (empty) to `size`"""
+    return size.bit_length()
+
+
+def puzzle_bytes(size: int) -> int:
+    """The length of a packed `size` by `size` puzzle"""
+    return -(-size * size * value_bits(size) // 8)
+
+
+def mask_bytes(size: int) -> int:
+    """The length of each box's candidates in a packed state, bit 0 of the first byte being the value 1"""
+    return -(-size // 8)
+
+
+def pack_values(values: Iterable[int], size: int) -> bytes:
+    """Pack the values of each box, row by row and 0 for empty, into `puzzle_bytes(size)` bytes"""
+    bits = value_bits(size)
+    if bits == 4:
+        values = bytes(values)
+        if len(values) % 2:
+            values += b'\0'
+        return bytes([low | high << 4 for low, high in zip(values[::2], values[1::2])])
+    packed = 0
+    for n, value in enumerate(values):
+        packed |= value << n * bits
+    return packed.to_bytes(puzzle_bytes(size), 'little')
+
+
+def unpack_values(data: bytes, size: int) -> List[int]:
+    """The values of each box, row by row and 0 for empty, from `pack_values`"""
+    bits = value_bits(size)
+    boxes = size * size
+    if bits == 4:
+        return [value for byte in data for value in (byte & 15, byte >> 4)][:boxes]
+    packed = int.from_bytes(data, 'little')
+    value_mask = (1 << bits) - 1
+    return [packed >> n * bits & value_mask for n in range(boxes)]
+
+
+def pack_puzzle(puzzle: Union[str, BoxGrid]) -> bytes:
+    """Pack a grid's givens, or a puzzle as written by `BoxGrid.to_string`"""
+    if isinstance(puzzle, BoxGrid):
+        return pack_values((box.value or 0 for row in puzzle.rows for box in row), puzzle.size)
+    puzzle = puzzle.strip()
+    size = round(len(puzzle) ** 0.5)
+    if size * size != len(puzzle):
+        raise ValueError(f"A puzzle of {len(puzzle)} boxes cannot be made into a square grid")
+    try:
+        values = puzzle.encode('ascii').translate(_VALUES)
+    except UnicodeEncodeError:
+        values = b'\xff'
+    if max(values) > size:
+        raise ValueError(f"Unexpected symbol found in puzzle {puzzle!r}")
+    return pack_values(values, size)
+
+
+def unpack_puzzle(data: bytes, size: int=9) -> str:
+    """The puzzle packed by `pack_puzzle`, as written by `BoxGrid.to_string`"""
+    if value_bits(size) == 4 and size <= 9:
+        # Grids up to 15x15 pack to 4 bits a box too, but only up to 9 does every value have a symbol in `_PAIRS`
+        return ''.join([_PAIRS[byte] for byte in data])[:size * size]
+    return ''.join(SYMBOLS[value - 1] if value else '.' for value in unpack_values(data, size))
+
+
+def pack_state(grid: BoxGrid) -> bytes:
+    """Pack a partially solved grid, its values followed by the candidates left in every box"""
+    size = grid.size
+    width = mask_bytes(size)
+    boxes = [box for row in grid.rows for box in row]
+    return (pack_values((box.value or 0 for box in boxes), size)
+            + b''.join((box.mask >> 1).to_bytes(width, 'little') for box in boxes))
+
+
+def unpack_state(data: bytes, block_height: int=3, block_width: int=3) -> BoxGrid:
+    """The grid packed by `pack_state`"""
+    size = block_height * block_width
+    width = mask_bytes(size)
+    start = puzzle_bytes(size)
+    grid = BoxGrid(size, size, block_height=block_height, block_width=block_width)
+    for n, value in enumerate(unpack_values(data[:start], size)):
+        box = grid[n % size, n // size]
+        box.mask = int.from_bytes(data[start + n * width:start + (n + 1) * width], 'little') << 1
+        box._value = value or None
+    return grid
+
+
+def write_corpus(path: Union[str, os.PathLike], puzzles: Iterable[Union[str, BoxGrid]], *, block_height: int=None,
+                 block_width: int=None) -> int:
+    """Write the puzzles, which must all be the same size, to a corpus file, returning how many there were
+
+    Puzzles are written as they come, so `puzzles` may be a generator over more than would fit in memory. The shape of
+    the blocks is that of the first puzzle if it is a grid, or else the usual one for its size, unless given.
+    """
+    count = 0
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for puzzle in puzzles:
+            packed = pack_puzzle(puzzle)
+            if not count:
+                length = len(packed)
+                size = puzzle.size if isinstance(puzzle, BoxGrid) else round(len(puzzle.strip()) ** 0.5)
+                if block_height is None or block_width is None:
+                    block_height, block_width = ((puzzle.block_height, puzzle.block_width)
+                                                 if isinstance(puzzle, BoxGrid) else block_shape(size))
+            elif len(packed) != length:
+                raise ValueError(f"Puzzle {count} is a different size to those before it")
+            f.write(packed)
+            count += 1
+        # Only now is the number of puzzles known
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, block_height or 3, block_width or 3, count))
+    return count
+
+
+class CorpusFile:
+    """A corpus file opened for reading, giving puzzle i as `corpus[i]` without reading any of the others
+
+    `record` gives the packed form of a puzzle as a view straight onto the mapped file, without copying it.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]):
+        self.path = os.fspath(path)
+        with open(self.path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise CorpusFormatException(f"{self.path} is too short to be a corpus file")
+        magic, version, self.block_height, self.block_width, self._count = HEADER.unpack_from(self._map)
+        if magic != MAGIC:
+            raise CorpusFormatException(f"{self.path} is not a corpus file")
+        if version != VERSION:
+            raise CorpusFormatException(f"{self.path} is version {version} of the format, only {VERSION} is understood")
+        self.size = self.block_height * self.block_width
+        self.record_size = puzzle_bytes(self.size)
+        if len(self._map) < HEADER.size + self._count * self.record_size:
+            raise CorpusFormatException(f"{self.path} is cut short, it should hold {self._count} puzzles")
+        self._view = memoryview(self._map)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def record(self, i: int) -> memoryview:
+        """The packed form of puzzle `i`"""
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(f"Puzzle {i} is out of range for a corpus of {self._count}")
+        start = HEADER.size + i * self.record_size
+        return self._view[start:start + self.record_size]
+
+    def __getitem__(self, i: int) -> str:
+        """Puzzle `i`, as written by `BoxGrid.to_string`"""
+        return unpack_puzzle(self.record(i), self.size)
+
+    def grid(self, i: int) -> BoxGrid:
+        return BoxGrid.from_string(self[i], block_height=self.block_height, block_width=self.block_width)
+
+    def puzzles(self, start: int=0, stop: int=None) -> Iterator[str]:
+        """Yield the puzzles from `start` up to (but not including) `stop`, or the end"""
+        stop = self._count if stop is None else min(stop, self._count)
+        for i in range(start, stop):
+            yield self[i]
+
+    def grids(self, start: int=0, stop: int=None) -> Iterator[BoxGrid]:
+        """Yield the puzzles from `start` up to (but not including) `stop`, or the end, as grids of the file's shape"""
+        stop = self._count if stop is None else min(stop, self._count)
+        for i in range(start, stop):
+            yield self.grid(i)
+
+    def __iter__(self) -> Iterator[str]:
+        return self.puzzles()
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+    def __enter__(self) -> 'CorpusFile':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __reduce__(self):
+        # Workers map the file for themselves, rather than being sent what is in it
+        return open_corpus, (self.path,)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.path!r})"
+
+
+@lru_cache(maxsize=8)
+def open_corpus(path: str) -> CorpusFile:
+    """Open a corpus file, or get the one this process already has open"""
+    return CorpusFile(path)
+
+
+def main(argv=None) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(description="Pack puzzles given one per line into a corpus file")
+    parser.add_argument('infile', type=argparse.FileType('r'), help="file of puzzles, one per line")
+    parser.add_argument('outfile', help="corpus file to write")
+    parser.add_argument('--block-height', type=int)
+    parser.add_argument('--block-width', type=int)
+    args = parser.parse_args(argv)
+
+    from puzzle_io import read_puzzles
+    count = write_corpus(args.outfile, read_puzzles(args.infile), block_height=args.block_height,
+                         block_width=args.block_width)
+    print(f"Packed {count} puzzles into {args.outfile}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
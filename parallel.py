@@ -0,0 +1,263 @@
+"""Searching a single hard puzzle across several processes at once
+
+Once propagation stalls, the search tree is split at its first few branch points: every way of making the first few
+guesses is tried here, and each that propagation doesn't refute becomes a part, sent to a worker process as a packed
+state (see `packed`). The workers search their parts just as `SudokuSolver.search` does, and as soon as enough
+solutions have turned up (one to solve a puzzle, two to know it isn't unique) a shared event is set, which every worker
+checks before each guess, so the rest give up straight away.
+
+    with ParallelSearch(workers=8) as search:
+        search.solve(grid)
+        unique = search.count_solutions(other_grid) == 1
+"""
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import lru_cache
+from time import monotonic
+from typing import List, Optional, Set, Tuple
+
+from grid import BoxGrid, GridSnapshot, values_of
+from packed import pack_state, unpack_state
+from solver import SolveLimitException, SudokuSolver, UnfinishableException, UnsolvableException
+
+# How many parts to split the search into for each worker, so that those which finish early have more to take on
+PARTS_PER_WORKER = 4
+# The most guesses deep the search is split, however few parts that gives
+MAX_SPLIT_DEPTH = 8
+# The longest spent splitting the search, so that the workers aren't kept waiting for their parts
+MAX_SPLIT_SECONDS = 0.005
+
+# The event a worker process checks to know it should give up, set up by `_init_worker`
+_cancel = None
+# Whether this process is a worker of some pool, which should solve with what it has rather than start a pool of its own
+_pool_worker = False
+
+
+def _init_worker(cancel):
+    global _cancel
+    _cancel = cancel
+    pool_worker()
+
+
+def pool_worker():
+    """Mark this process as a worker of a pool, so that `ParallelSolver`s solve in it rather than start more processes
+
+    This is the initializer of pools whose workers might be given the 'parallel' engine, such as those of `batch`, which
+    would otherwise each start a pool of their own, a processor's worth of processes for every worker.
+    """
+    global _pool_worker
+    _pool_worker = True
+
+
+def expand(solver: SudokuSolver, state: GridSnapshot, children: List[GridSnapshot], solutions: List[str]):
+    """Make every guess in the most constrained box of a propagated state, keeping a snapshot of each which propagation
+    doesn't refute, and the solution of any which finish the grid
+
+    The solver's grid is left as the state was.
+    """
+    solver.grid.restore(state)
+    box = solver.choose_box()
+    if box is None:
+        solutions.append(solver.grid.to_string())
+        return
+    for value in values_of(box.mask):
+        mark = len(solver._trail)
+        try:
+            solver.place(box, value)
+            solver.propagate()
+            if solver.choose_box() is None:
+                solutions.append(solver.grid.to_string())
+            else:
+                children.append(solver.grid.snapshot())
+        except SolveLimitException:
+            raise
+        except UnsolvableException:
+            pass
+        finally:
+            solver.undo(mark)
+
+
+def split(solver: SudokuSolver, parts: int, limit: int, max_depth: int=MAX_SPLIT_DEPTH,
+          max_seconds: float=MAX_SPLIT_SECONDS) -> Tuple[List[bytes], List[str], int]:
+    """Split the search of an already propagated solver into at least `parts` packed states, if it can be done quickly
+
+    The split goes one guess deeper at a time, each level made from the states of the one before, until there are
+    enough parts, a level has no more states than the one before (so the tree is narrowing rather than branching out),
+    or `max_depth` is reached. Once `max_seconds` have gone, the states not yet split are kept as they are. It stops as
+    soon as `limit` solutions are found. Returns the states, the solutions found on the way, and how many guesses deep
+    the deepest state is. The solver's grid is put back as it was afterwards.
+    """
+    root = solver.grid.snapshot()
+    stop = monotonic() + max_seconds
+    states, solutions, depth = [root], [], 0
+    try:
+        while len(states) < parts and depth < max_depth:
+            children: List[GridSnapshot] = []
+            for n, state in enumerate(states):
+                if n and monotonic() >= stop:
+                    children.extend(states[n:])
+                    break
+                expand(solver, state, children, solutions)
+                if len(solutions) >= limit:
+                    return [], solutions, depth + 1
+            depth += 1
+            narrowing = len(children) <= len(states)
+            states = children
+            if narrowing or monotonic() >= stop:
+                break
+        packed = []
+        for state in states:
+            solver.grid.restore(state)
+            packed.append(pack_state(solver.grid))
+        return packed, solutions, depth
+    finally:
+        solver.grid.restore(root)
+
+
+def search_part(state: bytes, block_height: int, block_width: int, limit: int, timeout: Optional[float],
+                max_nodes: Optional[int], options: dict) -> Tuple[List[str], bool]:
+    """Search one part in a worker, returning up to `limit` solutions, and whether the depth limit cut it short"""
+    grid = unpack_state(state, block_height, block_width)
+    solver = SudokuSolver(grid, **options)
+    solver.cancel = _cancel
+    solver.deadline = None if timeout is None else monotonic() + timeout
+    solver.max_nodes = max_nodes
+    solutions: List[str] = []
+    try:
+        solver.propagate_givens()
+        solver.propagate()
+        for solution in solver.search():
+            solutions.append(solution.to_string())
+            if len(solutions) >= limit:
+                break
+    except SolveLimitException:
+        if not _cancel.is_set():
+            raise
+    except UnfinishableException:
+        return solutions, True
+    except UnsolvableException:
+        pass
+    return solutions, False
+
+
+class ParallelSearch:
+    """A pool of worker processes which search puzzles between them, one puzzle at a time
+
+    The pool is kept between puzzles, so only the first pays for starting the processes. `workers` defaults to the
+    number of processors.
+    """
+
+    def __init__(self, workers: Optional[int]=None):
+        self._cancel = multiprocessing.Event()
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(self._cancel,))
+        self.workers: int = self._executor._max_workers
+        # Parts of the last search still winding down after being cancelled
+        self._running: Set[Future] = set()
+
+    def find(self, grid: BoxGrid, limit: int, *, deadline: float=None, max_nodes: int=None, **options) -> List[str]:
+        """Find up to `limit` solutions of the grid, as written by `BoxGrid.to_string`, leaving the grid as it was
+
+        `deadline` applies to the whole search, and `max_nodes` to each part of it. Any other `options` are passed on
+        to each `SudokuSolver`. Raises as `SudokuSolver.count_solutions` does.
+        """
+        # Anything cancelled last time has to have seen the event before it can be cleared again
+        wait(self._running)
+        self._running = set()
+        self._cancel.clear()
+
+        solver = SudokuSolver(grid.deep_copy(), **options)
+        solver.deadline = deadline
+        try:
+            solver.propagate_givens()
+            solver.propagate()
+            if solver.choose_box() is None:
+                return [solver.grid.to_string()]
+            states, solutions, depth = split(solver, PARTS_PER_WORKER * self.workers, limit,
+                                             min(MAX_SPLIT_DEPTH, solver.max_emergency_depth))
+        except SolveLimitException:
+            raise
+        except UnsolvableException:
+            return []
+        if len(solutions) >= limit or not states:
+            return solutions[:limit]
+
+        # The guesses made in splitting count towards the depth each part can go to
+        options['max_emergency_depth'] = solver.max_emergency_depth - depth
+        timeout = None if deadline is None else max(deadline - monotonic(), 0)
+        futures = [self._executor.submit(search_part, state, grid.block_height, grid.block_width,
+                                         limit - len(solutions), timeout, max_nodes, options)
+                   for state in states]
+        pending: Set[Future] = set(futures)
+        depth_limited = False
+        try:
+            while pending and len(solutions) < limit:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    found, cut_short = future.result()
+                    solutions.extend(found)
+                    depth_limited |= cut_short
+        finally:
+            self._cancel.set()
+            for future in pending:
+                future.cancel()
+            self._running = {future for future in futures if not future.done()}
+
+        if len(solutions) < limit and depth_limited:
+            raise UnfinishableException('Cannot solve as recursive depth limit reached')
+        return solutions[:limit]
+
+    def solve(self, grid: BoxGrid, *, deadline: float=None, max_nodes: int=None, **options):
+        """Solve the grid in place with whichever solution is found first"""
+        solutions = self.find(grid, 1, deadline=deadline, max_nodes=max_nodes, **options)
+        if not solutions:
+            raise UnsolvableException('No way of finishing the grid was found')
+        SudokuSolver(grid).fill(solutions[0])
+
+    def count_solutions(self, grid: BoxGrid, limit: int=2, **options) -> int:
+        """Count the solutions of the grid, up to `limit`, stopping every worker as soon as that many are found"""
+        return len(self.find(grid, limit, **options))
+
+    def close(self):
+        self._cancel.set()
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self) -> 'ParallelSearch':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@lru_cache(maxsize=None)
+def shared_search(workers: Optional[int]=None) -> ParallelSearch:
+    """The pool this process uses for `ParallelSolver`s with the given number of workers, started the first time"""
+    return ParallelSearch(workers)
+
+
+class ParallelSolver:
+    """The 'parallel' engine, solving a grid with a `ParallelSearch` shared by the whole process
+
+    In the workers of a pool (see `pool_worker`), which already have the other processors busy, and in daemonic
+    processes, such as the workers of `server`, which can't start processes of their own, the grid is solved by a plain
+    `SudokuSolver` instead.
+    """
+
+    def __init__(self, grid: BoxGrid, *, workers: Optional[int]=None, **options):
+        self.grid = grid
+        self.workers = workers
+        self.options = options
+
+    def solve(self, *, deadline: float=None, max_nodes: int=None):
+        if _pool_worker or multiprocessing.current_process().daemon:
+            SudokuSolver(self.grid, **self.options).solve(deadline=deadline, max_nodes=max_nodes)
+        else:
+            shared_search(self.workers).solve(self.grid, deadline=deadline, max_nodes=max_nodes, **self.options)
+
+
+def count_solutions(grid: BoxGrid, limit: int=2, *, workers: Optional[int]=None, **options) -> int:
+    """Count the solutions of the grid, up to `limit`, across a shared pool of `workers` processes"""
+    return shared_search(workers).count_solutions(grid, limit, **options)
+
+
+def is_unique(grid: BoxGrid, *, workers: Optional[int]=None, **options) -> bool:
+    return count_solutions(grid, 2, workers=workers, **options) == 1
@@ -0,0 +1,61 @@
+"""Streaming reading and writing of puzzles in the one-puzzle-per-line format
+
+Each line holds one puzzle, written out row by row as in `BoxGrid.from_string`: '1'-'9' for filled boxes and '.' or '0'
+for empty ones, with letters for values over 9 in larger grids. Blank lines and lines starting with '#' are skipped.
+Everything here works a line at a time, so files of any size can be streamed through at a constant memory footprint.
+"""
+import sys
+from typing import Iterable, Iterator, TextIO, Union
+
+from batch import BatchResult, solve_corpus, solve_many
+from grid import BoxGrid
+
+
+def read_puzzles(file: TextIO) -> Iterator[str]:
+    """Yield each puzzle line of the file, stripped of whitespace"""
+    for line in file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def read_grids(file: TextIO) -> Iterator[BoxGrid]:
+    """Yield a grid for each puzzle in the file"""
+    for puzzle in read_puzzles(file):
+        yield BoxGrid.from_string(puzzle)
+
+
+def write_grids(grids: Iterable[Union[BoxGrid, str]], file: TextIO):
+    """Write each grid (or already encoded puzzle) to the file, one per line"""
+    for grid in grids:
+        file.write(grid.to_string() if isinstance(grid, BoxGrid) else grid)
+        file.write('\n')
+
+
+def solve_file(infile: TextIO=sys.stdin, outfile: TextIO=sys.stdout, errfile: TextIO=sys.stderr, *,
+               workers: int=1, **options) -> int:
+    """Solve every puzzle of `infile`, writing a line to `outfile` for each, returning how many could not be solved
+
+    Puzzles are solved as they are read (see `batch.solve_many` for the options), and only in this process unless more
+    `workers` are asked for. Puzzles which could not be solved are written out unchanged, so the output lines up with
+    the input, and the reason is written to `errfile`.
+    """
+    return write_results(solve_many(read_puzzles(infile), workers=workers, **options), outfile, errfile)
+
+
+def solve_corpus_file(path: str, outfile: TextIO=sys.stdout, errfile: TextIO=sys.stderr, *, workers: int=1,
+                      **options) -> int:
+    """Solve every puzzle of a corpus file (see `packed`), writing them out as `solve_file` does"""
+    return write_results(solve_corpus(path, workers=workers, **options), outfile, errfile)
+
+
+def write_results(results: Iterable[BatchResult], outfile: TextIO, errfile: TextIO) -> int:
+    """Write a line for each result, the solution or the puzzle unchanged, returning how many could not be solved"""
+    failures = 0
+    for n, puzzle, solution, error in results:
+        if error is not None:
+            failures += 1
+            errfile.write(f"puzzle {n + 1}: {error.__class__.__name__}: {error}\n")
+        outfile.write(solution or puzzle)
+        outfile.write('\n')
+    return failures
@@ -0,0 +1,380 @@
+"""A local solving service, for other programs to send puzzles to over a socket
+
+    python main.py serve --port 8765 --workers 4
+    python main.py client puzzles.txt --port 8765
+
+Each line sent is one request, and gets one line back, in the same order as the requests on that connection. A request
+is either a plain puzzle (as in `puzzle_io`), answered with its solution or with 'ERROR <type>: <reason>', or a JSON
+object, answered with a JSON object:
+
+    {"id": 1, "puzzle": "53..7....", "engine": "dlx", "timeout": 2.5}  ->  {"id": 1, "solution": "534678912..."}
+                                                                        or  {"id": 1, "error": "...", "type": "..."}
+    {"command": "health"}   ->  {"status": "ok", "workers": 4, "busy": 1, "queued": 0}
+    {"command": "metrics"}  ->  {"requests": 10, "solved": 9, ..., "p50_ms": 3.1, "p99_ms": 250.2}
+
+The plain words 'health' and 'metrics' work too. Puzzles are solved in a fixed number of worker processes, which give
+up on a puzzle once its timeout has run out (see `SudokuSolver.solve`). A request can shorten the server's timeout but
+not lengthen it. Should a worker not manage that within `KILL_GRACE` seconds more, it is killed and replaced, so no
+puzzle can hold up the service for long. Requests wait in a bounded queue for a worker, and while it is full,
+connections stop being read from, so that clients are slowed down rather than the server running out of memory.
+"""
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+from collections import defaultdict, deque
+from multiprocessing.connection import Connection
+from time import monotonic, perf_counter
+from typing import AsyncIterator, Deque, Dict, Iterable, Optional, TextIO, Tuple
+
+import engines
+from batch import solve_puzzle
+from benchmark import percentile
+from puzzle_io import read_puzzles
+from solver import SolveLimitException
+
+logger = logging.getLogger(__name__)
+
+# How many recent requests the latency percentiles of the metrics are taken over
+LATENCY_WINDOW = 1000
+# How many seconds past its timeout a worker is given to stop by itself before it is killed
+KILL_GRACE = 1.0
+
+
+class RequestTimeoutException(Exception): pass
+
+
+# What a worker sends back for each puzzle: the solution, or the type and message of the error raised
+Outcome = Tuple[Optional[str], Optional[str], Optional[str]]
+
+
+def worker_main(connection: Connection):
+    """Solve each (puzzle, engine, timeout) received, sending back (solution, error type, error message)"""
+    logging.getLogger('solver').setLevel(logging.ERROR)
+    while True:
+        try:
+            puzzle, engine, timeout = connection.recv()
+        except EOFError:
+            return
+        deadline = monotonic() + timeout if timeout is not None else None
+        _, _, solution, error = solve_puzzle(0, puzzle, engine, deadline=deadline)
+        if error is None:
+            connection.send((solution, None, None))
+        elif isinstance(error, SolveLimitException):
+            connection.send((None, RequestTimeoutException.__name__, f"Not solved within {timeout} seconds"))
+        else:
+            connection.send((None, error.__class__.__name__, str(error)))
+
+
+class Worker:
+    """A process solving one puzzle at a time, which can be killed and replaced if it takes too long"""
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_main, args=(child_connection,), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def stop(self):
+        self.connection.close()
+        self.process.kill()
+        self.process.join()
+
+    async def solve(self, puzzle: str, engine: str, timeout: Optional[float]) -> Outcome:
+        """Have the worker solve the puzzle, giving up after `timeout` seconds
+
+        The worker is told the timeout, and stops by itself when it runs out. If it hasn't within `KILL_GRACE` seconds
+        more, or this is cancelled, it is killed and restarted.
+        """
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fileno = self.connection.fileno()
+        loop.add_reader(fileno, lambda: ready.done() or ready.set_result(None))
+        try:
+            self.connection.send((puzzle, engine, timeout))
+            await asyncio.wait_for(ready, timeout + KILL_GRACE if timeout is not None else None)
+            loop.remove_reader(fileno)
+            return self.connection.recv()
+        except (EOFError, OSError):
+            loop.remove_reader(fileno)
+            self.restart()
+            return None, 'WorkerDiedException', "The worker solving the puzzle died"
+        except BaseException:
+            # Timed out, cancelled, or anything else, the worker may still be on the puzzle, so it starts afresh
+            loop.remove_reader(fileno)
+            self.restart()
+            raise
+
+
+class Job:
+    """A puzzle waiting to be solved, and the future its outcome will be given to"""
+    __slots__ = ('puzzle', 'engine', 'timeout', 'future')
+
+    def __init__(self, puzzle: str, engine: str, timeout: Optional[float]):
+        self.puzzle = puzzle
+        self.engine = engine
+        self.timeout = timeout
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class SolveServer:
+    def __init__(self, *, workers: int=None, queue_size: int=256, timeout: Optional[float]=10.0,
+                 engine: str='heuristic'):
+        self.worker_count = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.engine = engine
+        self.queue_size = queue_size
+        self.workers = []
+        self.busy = 0
+        self.metrics: Dict[str, int] = defaultdict(int)
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    async def start(self):
+        """Start the workers, and the tasks feeding them from the queue"""
+        self.queue: 'asyncio.Queue[Job]' = asyncio.Queue(self.queue_size)
+        self.workers = [Worker() for _ in range(self.worker_count)]
+        self._dispatchers = [asyncio.ensure_future(self.dispatch(worker)) for worker in self.workers]
+
+    async def stop(self):
+        for dispatcher in self._dispatchers:
+            dispatcher.cancel()
+        await asyncio.gather(*self._dispatchers, return_exceptions=True)
+        for worker in self.workers:
+            worker.stop()
+
+    async def dispatch(self, worker: Worker):
+        """Hand queued jobs to the worker one at a time, for as long as the server runs"""
+        while True:
+            job = await self.queue.get()
+            if job.future.done():
+                # The connection it came from has gone away
+                continue
+            self.busy += 1
+            start = perf_counter()
+            try:
+                outcome = await worker.solve(job.puzzle, job.engine, job.timeout)
+            except asyncio.TimeoutError:
+                self.metrics['killed'] += 1
+                outcome = None, RequestTimeoutException.__name__, f"Not solved within {job.timeout} seconds"
+            except Exception as e:
+                # Whatever went wrong with this job, the dispatcher has to carry on with the next
+                logger.exception("Failed to hand a puzzle to a worker")
+                outcome = None, e.__class__.__name__, str(e)
+            finally:
+                self.busy -= 1
+            if outcome[1] == RequestTimeoutException.__name__:
+                self.metrics['timeouts'] += 1
+            self.latencies.append(perf_counter() - start)
+            self.metrics['solved' if outcome[1] is None else 'failed'] += 1
+            if not job.future.done():
+                job.future.set_result(outcome)
+
+    def health(self) -> dict:
+        alive = sum(worker.process.is_alive() for worker in self.workers)
+        return {
+            'status': 'ok' if alive == len(self.workers) else 'degraded',
+            'workers': len(self.workers),
+            'alive': alive,
+            'busy': self.busy,
+            'queued': self.queue.qsize(),
+        }
+
+    def get_metrics(self) -> dict:
+        latencies = sorted(self.latencies)
+        metrics = {name: self.metrics[name] for name in ('connections', 'requests', 'solved', 'failed', 'timeouts',
+                                                         'killed', 'bad_requests')}
+        metrics['queued'] = self.queue.qsize()
+        metrics['busy'] = self.busy
+        for fraction in (0.5, 0.9, 0.99):
+            metrics[f'p{round(fraction * 100)}_ms'] = percentile(latencies, fraction) * 1000 if latencies else None
+        return metrics
+
+    async def handle_line(self, line: str) -> 'asyncio.Future[str]':
+        """Start handling one request, returning a future of the line to respond with
+
+        This only waits for there to be room in the queue, not for the puzzle to be solved, so that a connection can
+        have many requests in flight at once.
+        """
+        loop = asyncio.get_running_loop()
+        response = loop.create_future()
+        as_json = line.startswith('{')
+        request = {}
+        try:
+            request = json.loads(line) if as_json else {'command': line.lower()} if line.isalpha() else {'puzzle': line}
+            if not isinstance(request, dict):
+                raise ValueError("A request must be a JSON object")
+            command = request.get('command')
+            if command is not None:
+                if command == 'health':
+                    response.set_result(json.dumps(self.health()))
+                elif command == 'metrics':
+                    response.set_result(json.dumps(self.get_metrics()))
+                else:
+                    raise ValueError(f"Unknown command {command!r}")
+                return response
+            puzzle = request.get('puzzle')
+            if not isinstance(puzzle, str):
+                raise ValueError("A request needs either a 'puzzle' string or a 'command'")
+            engine = request.get('engine', self.engine)
+            if engine not in engines.ENGINES:
+                raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(engines.ENGINES)}")
+            timeout = self.request_timeout(request)
+        except ValueError as e:
+            self.metrics['bad_requests'] += 1
+            response.set_result(self.format_response(request, as_json, None, 'BadRequest', str(e) or repr(e)))
+            return response
+
+        self.metrics['requests'] += 1
+        job = Job(puzzle, engine, timeout)
+        await self.queue.put(job)
+
+        def respond(future: asyncio.Future):
+            if not future.cancelled() and not response.done():
+                response.set_result(self.format_response(request, as_json, *future.result()))
+
+        job.future.add_done_callback(respond)
+        # If the connection goes before the job is started, don't bother solving it
+        response.add_done_callback(lambda _: job.future.done() or job.future.cancel())
+        return response
+
+    def request_timeout(self, request: dict) -> Optional[float]:
+        """The timeout a request asks for, which can be shorter than the server's but no longer"""
+        if 'timeout' not in request:
+            return self.timeout
+        timeout = request['timeout']
+        if isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or not 0 < timeout < math.inf:
+            raise ValueError(f"A 'timeout' must be a positive number of seconds, not {timeout!r}")
+        return timeout if self.timeout is None else min(timeout, self.timeout)
+
+    @staticmethod
+    def format_response(request: dict, as_json: bool, solution: Optional[str], error_type: Optional[str],
+                        error: Optional[str]) -> str:
+        if not as_json:
+            return solution if error_type is None else f'ERROR {error_type}: {error}'
+        response = {'id': request['id']} if 'id' in request else {}
+        if error_type is None:
+            response['solution'] = solution
+        else:
+            response['error'] = error
+            response['type'] = error_type
+        return json.dumps(response)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Read requests from a connection, and write their responses back in the same order as they finish in turn"""
+        self.metrics['connections'] += 1
+        # Bounding this as well as the shared queue stops one connection from having everything in flight at once
+        responses: 'asyncio.Queue[Optional[asyncio.Future]]' = asyncio.Queue(self.queue_size)
+
+        async def write_responses():
+            while True:
+                response = await responses.get()
+                if response is None:
+                    return
+                writer.write((await response).encode() + b'\n')
+                await writer.drain()
+
+        writing = asyncio.ensure_future(write_responses())
+        pending = []
+        try:
+            while not writing.done():
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode().strip()
+                if not line:
+                    continue
+                response = await self.handle_line(line)
+                pending.append(response)
+                await responses.put(response)
+                if len(pending) > self.queue_size:
+                    pending = [p for p in pending if not p.done()]
+            await responses.put(None)
+            await writing
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writing.cancel()
+            for response in pending:
+                response.cancel()
+            writer.close()
+
+    async def serve(self, host: str='127.0.0.1', port: int=8765, path: str=None):
+        """Serve on a TCP port, or a Unix socket at `path` if given, until cancelled"""
+        await self.start()
+        try:
+            if path is not None:
+                server = await asyncio.start_unix_server(self.handle_connection, path)
+            else:
+                server = await asyncio.start_server(self.handle_connection, host, port)
+            logger.info("Serving on %s with %d workers", path or f'{host}:{port}', self.worker_count)
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+class SolveClient:
+    """A client for `SolveServer`, sending it JSON requests"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host: str='127.0.0.1', port: int=8765, path: str=None) -> 'SolveClient':
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, request: dict) -> dict:
+        self.writer.write(json.dumps(request).encode() + b'\n')
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def solve(self, puzzle: str, **options) -> dict:
+        return await self.request({'puzzle': puzzle, **options})
+
+    async def solve_many(self, puzzles: Iterable[str], *, window: int=64, **options) -> AsyncIterator[dict]:
+        """Send the puzzles, keeping up to `window` of them in flight at once, and yield each response in order"""
+        sent = received = 0
+        for puzzle in puzzles:
+            self.writer.write(json.dumps({'id': sent, 'puzzle': puzzle, **options}).encode() + b'\n')
+            sent += 1
+            if sent - received >= window:
+                await self.writer.drain()
+                yield json.loads(await self.reader.readline())
+                received += 1
+        await self.writer.drain()
+        while received < sent:
+            yield json.loads(await self.reader.readline())
+            received += 1
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def solve_file(infile: TextIO, outfile: TextIO, errfile: TextIO, *, host: str='127.0.0.1', port: int=8765,
+                     path: str=None, **options) -> int:
+    """As `puzzle_io.solve_file`, but having a server solve the puzzles"""
+    client = await SolveClient.connect(host, port, path)
+    failures = 0
+    try:
+        puzzles = list(read_puzzles(infile))
+        async for response in client.solve_many(puzzles, **options):
+            if 'error' in response:
+                failures += 1
+                errfile.write(f"puzzle {response['id'] + 1}: {response['type']}: {response['error']}\n")
+            outfile.write(response.get('solution') or puzzles[response['id']])
+            outfile.write('\n')
+    finally:
+        await client.close()
+    return failures
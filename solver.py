@@ -1,163 +1,705 @@
-from typing import List, Set, Optional, Tuple
+import logging
+import os
+import random
+from collections import deque
+from itertools import combinations
+from time import monotonic, perf_counter
+from typing import Deque, Iterator, List, NamedTuple, Optional, Sequence, Tuple
 
-from grid import Box, BoxGrid, Coordinate
+from cache import SolutionCache
+from grid import Box, BoxGrid, Coordinate, GridSnapshot, bit_value, full_mask, mask_of, popcount, values_of
+from stats import SolveStats
+
+logger = logging.getLogger(__name__)
 
 
 class UnsolvableException(ValueError): pass
 
 class UnfinishableException(UnsolvableException): pass
 
+class SolveLimitException(UnfinishableException):
+    """Raised when solving runs past its deadline or its limit of guesses
+
+    `grid` is the grid as far as it had been worked out, without any of the guesses being tried at the time, and
+    `nodes` and `backtracks` are the guesses made and taken back before giving up (`stats` has more, if it was given).
+    """
+
+    def __init__(self, message: str, grid: BoxGrid=None, nodes: int=0, backtracks: int=0, stats: SolveStats=None,
+                 checkpoint: 'Checkpoint'=None):
+        super().__init__(message)
+        self.grid = grid
+        self.nodes = nodes
+        self.backtracks = backtracks
+        self.stats = stats
+        # Where the search had got to, if it was searching, for `SudokuSolver.resume` to carry on from
+        self.checkpoint = checkpoint
+
+    def __reduce__(self):
+        return self.__class__, (self.args[0], self.grid, self.nodes, self.backtracks, self.stats, self.checkpoint)
+
+
+class Checkpoint(NamedTuple):
+    """How far a search had got, from which `SudokuSolver.resume` can carry on, in this process or any other
+
+    It holds only snapshots and tuples of ints, so it pickles small and can be sent to another process to finish.
+    """
+    # The grid as it was when the search started
+    root: GridSnapshot
+    # For each guess stacked up, the box's coordinates, the possibilities not yet tried, and the one being tried (or 0)
+    decisions: Tuple[Tuple[Coordinate, int, int], ...]
+    nodes: int
+    backtracks: int
+    # Whether `max_emergency_depth` has already cut part of the search short
+    depth_limited: bool
+
+
+# Every rule the solver knows, by the first part of their method names, from the cheapest to the most expensive
+RULES = ('naked_singles', 'hidden_singles', 'pointing', 'box_line', 'naked_pairs', 'hidden_pairs', 'naked_triples',
+         'hidden_triples', 'naked_quads', 'hidden_quads')
+
+
+def parse_rules(text: str) -> Tuple[str, ...]:
+    """Read a comma separated list of rule names, ignoring spaces and empty names, and checking each is in `RULES`"""
+    names = tuple(name for name in (part.strip() for part in text.split(',')) if name)
+    unknown = [name for name in names if name not in RULES]
+    if not names or unknown:
+        raise ValueError(f"Expected a comma separated list of some of {', '.join(RULES)} in {text!r}"
+                         + (f", not {', '.join(unknown)}" if unknown else ''))
+    return names
+
+
+def default_rules() -> Tuple[str, ...]:
+    """The rules set for a whole deployment with the SUDOKU_RULES environment variable, or else every rule"""
+    text = os.environ.get('SUDOKU_RULES', '')
+    if not text.strip():
+        return RULES
+    try:
+        return parse_rules(text)
+    except ValueError as e:
+        raise ValueError(f"The SUDOKU_RULES environment variable is not valid: {e}") from None
+
+
+# The rules used when none are given, checked once here so that a mistake shows up as soon as anything starts
+DEFAULT_RULES = default_rules()
+
+
+def find_subset(masks: Sequence[int], size: int) -> Optional[Tuple[Tuple[int, ...], int]]:
+    """Find `size` of the masks which only have `size` bits between them, returning their indexes and combined mask
+
+    Masks with more than `size` bits can't be part of such a subset, so only the others are combined, a fixed number at
+    a time. Raises `UnsolvableException` if some are found with fewer than `size` bits between them.
+    """
+    small = [i for i, mask in enumerate(masks) if popcount(mask) <= size]
+    for indexes in combinations(small, size):
+        union = 0
+        for i in indexes:
+            union |= masks[i]
+        count = popcount(union)
+        if count == size:
+            return indexes, union
+        if count < size:
+            raise UnsolvableException(f"{size} boxes only have {set(values_of(union))} between them")
+    return None
+
+
 class SudokuSolver:
-    def __init__(self, grid: BoxGrid, *, max_emergency_depth: int=81):
+    def __init__(self, grid: BoxGrid, *, max_emergency_depth: Optional[int]=None, cache: SolutionCache=None,
+                 stats: SolveStats=None, rules: Sequence[str]=None):
         self.grid = grid
-        self.max_emergency_depth = max_emergency_depth
-
-    def solve(self):
-        previous_grid = None
-        while not self.grid.check_complete():
-            if previous_grid == self.grid:
-                if self.max_emergency_depth:
-                    print("WARNING 007 - Engaging emergency measures")
-                    print("This could take a while, go make a hot chocolate or something...")
-                    self.grid.columns = self.emergency_measures().columns
+        # As many guesses as there are boxes by default, which never cuts the search short
+        self.max_emergency_depth = grid.height * grid.width if max_emergency_depth is None else max_emergency_depth
+        # The rules applied to each unit, cheapest first, as leaving out costlier ones can make searching quicker
+        self.rule_names = tuple(DEFAULT_RULES if rules is None else rules)
+        unknown = set(self.rule_names) - set(RULES)
+        if not self.rule_names:
+            raise ValueError(f"At least one rule is needed, from {', '.join(RULES)}")
+        if unknown:
+            raise ValueError(f"Unknown rules {', '.join(sorted(unknown))}, expected some of {', '.join(RULES)}")
+        self.rules = [getattr(self, f'{name}_rule') for name in self.rule_names]
+        # Where to record the work done, if anywhere
+        self.stats = stats
+        # Solutions of puzzles seen before, or ones equivalent to them, which are used rather than solving again
+        self.cache = cache
+        # For each rule, the units (numbered as in `UnitIndex`) waiting for it to look at them, either because one of
+        # their boxes changed (for the first rule) or because the rule before has finished with them (for the rest)
+        self._queues: List[Deque[int]] = [deque() for _ in self.rules]
+        self._queued: List[List[bool]] = [[False] * len(grid.index.units) for _ in self.rules]
+        self._cell_units = grid.index.cell_units
+        # Every change made to a box, as (box, previous mask, previous value), so that guesses can be undone
+        self._trail: List[Tuple[Box, int, Optional[int]]] = []
+        # The length of the trail before each value put in with `enter`, and the box it went in
+        self._entries: List[Tuple[int, Box]] = []
+        # The grid when the search started, and the stack of guesses it is making, each as [box being guessed,
+        # possibilities not yet tried, trail length before the guess, bit of the guess being tried or 0]
+        self._root: Optional[GridSnapshot] = None
+        self._stack: List[List] = []
+        self._depth_limited = False
+        # How many guesses the emergency search made, and how many of those it had to take back
+        self.nodes = 0
+        self.backtracks = 0
+        # When to give up, as a `time.monotonic` time, and after how many guesses, if ever (see `solve`)
+        self.deadline: Optional[float] = None
+        self.max_nodes: Optional[int] = None
+        # Something with an `is_set` method, such as a `multiprocessing.Event`, which when set stops the search at the
+        # next guess, for when another process has already got what was wanted (see `parallel`)
+        self.cancel = None
+
+    def solve(self, *, deadline: float=None, max_nodes: int=None):
+        """Solve the grid in place
+
+        If the `deadline` (a `time.monotonic` time) passes, or `max_nodes` guesses have been made, before it is solved,
+        this gives up by raising `SolveLimitException`. Both are checked between steps, so it may run a little over.
+
+        With a `cache`, an exact repeat of a puzzle is answered from it straight away, and one which propagation can't
+        finish is looked up (and then saved) under its canonical form. Grids with candidates already ruled out aren't.
+        """
+        self.deadline, self.max_nodes = deadline, max_nodes
+        self._trail = []
+        puzzle = key = None
+        if self.cache is not None and self.cacheable():
+            puzzle = self.grid.to_string()
+            key = self.cache.known_key(puzzle)
+            if key is not None:
+                solution = self.cache.lookup(*key)
+                if solution is not None:
+                    self.fill(solution)
+                    return
+
+        self.propagate_givens()
+        self.propagate()
+        if puzzle is not None:
+            if self.grid.check_complete():
+                # Propagation alone was quicker than canonicalizing would have been, so it isn't worth caching
+                key = None
+            elif key is None:
+                # Only now it needs searching is a new puzzle worth canonicalizing, to look for an equivalent one
+                key = self.cache.key(self.grid, puzzle)
+                solution = self.cache.lookup(*key)
+                if solution is not None:
+                    self.fill(solution)
                     return
+        self.finish(deadline=deadline, max_nodes=max_nodes)
+        if key is not None:
+            self.cache.store(*key, self.grid.to_string())
+
+    def cacheable(self) -> bool:
+        """Whether the grid is only its givens, with nothing yet ruled out of any empty box, as the cache keys them"""
+        full = full_mask(self.grid.size)
+        return all(box.is_filled or box.mask == full for column in self.grid.columns for box in column)
+
+    def finish(self, *, deadline: float=None, max_nodes: int=None):
+        """Carry on solving from wherever propagation has got to, searching if it can't get any further
+
+        `solve` uses this once the givens are in, and after values have been put in one at a time with `enter` it
+        finishes the grid without sweeping it all again. `deadline` and `max_nodes` are as for `solve`.
+        """
+        self.deadline, self.max_nodes = deadline, max_nodes
+        self.propagate()
+
+        if not self.grid.check_complete():
+            if self.max_emergency_depth:
+                logger.warning("WARNING 007 - Engaging emergency measures")
+                if self.stats is None:
+                    self.emergency_measures()
                 else:
-                    raise UnfinishableException('Cannot solve as recursive depth limit reached')
+                    self.stats.emit('emergency')
+                    start, nested = perf_counter(), self.rule_seconds()
+                    solved = False
+                    try:
+                        self.emergency_measures()
+                        solved = True
+                    finally:
+                        # The rules run after each guess are recorded as themselves, so their time is left out here,
+                        # leaving just the search's own, and it only got somewhere if it found a solution
+                        self.stats.record('emergency_measures', start + self.rule_seconds() - nested, progressed=solved)
+            else:
+                raise UnfinishableException('Cannot solve as recursive depth limit reached')
+
+        if self.stats is not None:
+            self.stats.emit('solved')
+
+    def rule_seconds(self) -> float:
+        """How long the stats have the rules taking so far"""
+        return sum(self.stats.seconds.get(name, 0.0) for name in self.rule_names)
+
+    def start(self):
+        """Get ready for values to be put in one at a time with `enter`, propagating whatever the grid already holds"""
+        self._trail = []
+        self._entries = []
+        self.propagate_givens()
+        self.propagate()
 
-            previous_grid = self.grid.deep_copy()
+    def enter(self, coords: Coordinate, value: int) -> List[Box]:
+        """Put a value in by hand, propagating its effects on the boxes around it, and return the boxes it forced
 
-            # Array meaning OrderedIterable, `arrays` is all rows, columns or blocks
-            for arrays in self.grid.all_arrays:
-                # `array` is a row, column or block
-                for array in arrays:
-                    for box in array:
-                        self.handle_box(box, array)
+        Only the units the change touches are looked at again, so this takes about as long as a single guess in the
+        search. If the value clashes with anything, `UnsolvableException` is raised with the grid left as it was. Each
+        value put in is kept in a journal, so that it can be taken back with `take_back`.
+        """
+        if not 0 < value <= self.grid.size:
+            raise ValueError(f"{value} can't go in a grid of size {self.grid.size}")
+        box = self.grid[coords]
+        if box.value == value:
+            return []
+        mark = len(self._trail)
+        try:
+            if box.is_filled:
+                raise UnsolvableException(f"The box at {coords} must hold {box.value}")
+            if not box.has_candidate(value):
+                raise UnsolvableException(f"{value} has already been ruled out of the box at {coords}")
+            self.place(box, value)
+            self.propagate()
+        except UnsolvableException:
+            self.undo(mark)
+            raise
+        self._entries.append((mark, box))
+        forced, seen = [], {id(box)}
+        for changed, _, _ in self._trail[mark:]:
+            if changed.is_filled and id(changed) not in seen:
+                seen.add(id(changed))
+                forced.append(changed)
+        return forced
+
+    @property
+    def entered(self) -> List[Box]:
+        """The boxes filled in with `enter` which haven't been taken back, oldest first"""
+        return [box for _, box in self._entries]
+
+    def take_back(self) -> Optional[Box]:
+        """Take back the last value put in with `enter`, and everything it forced, returning its box if there was one"""
+        if not self._entries:
+            return None
+        mark, box = self._entries.pop()
+        self.undo(mark)
+        return box
+
+    def fill(self, solution: str):
+        """Fill every empty box from a solution, as written by `BoxGrid.to_string`"""
+        solved = BoxGrid.from_string(solution, block_height=self.grid.block_height, block_width=self.grid.block_width)
+        for column, solved_column in zip(self.grid.columns, solved.columns):
+            for box, solved_box in zip(column, solved_column):
+                if not box.is_filled:
+                    box.value = solved_box.value
+        if self.grid.check_errors():
+            raise UnsolvableException("The solution given clashes with the boxes already filled in")
+
+    def propagate_givens(self):
+        """Remove the values of every filled box from its peers, and queue every unit to be looked at
+
+        This is the only time the whole grid is swept, after this only units which have changed are revisited.
+        """
+        units = len(self.grid.index.units)
+        self._queues = [deque() for _ in self.rules]
+        self._queued = [[False] * units for _ in self.rules]
+        self._queues[0].extend(range(units))
+        self._queued[0] = [True] * units
+        for column in self.grid.columns:
+            for box in column:
+                if box.is_filled:
+                    self.remove_from_peers(box)
+
+    def propagate(self):
+        """Apply the rules to queued units until no more progress can be made
+
+        Each rule has its own queue, and a rule is only applied once every rule before it has nothing left to do, so the
+        costlier rules only get a look in when the cheaper ones are stuck. A changed unit starts with the first rule,
+        and is handed on to each rule in turn after the one before has looked at it.
+        """
+        queues, queued, rules, rule_names = self._queues, self._queued, self.rules, self.rule_names
+        get_unit, stats, deadline = self.grid.get_unit, self.stats, self.deadline
+        first, last = queues[0], len(rules) - 1
+        k = 0
+        while k <= last:
+            queue = queues[k]
+            if not queue:
+                k += 1
+                continue
+            if deadline is not None and monotonic() >= deadline:
+                self.check_limits()
+            n = queue.popleft()
+            queued[k][n] = False
+            unit = get_unit(n)
+            if stats is None:
+                rules[k](n, unit)
+            else:
+                stats.sweeps += 1
+                start, changes = perf_counter(), stats.eliminations + stats.placements
+                rules[k](n, unit)
+                stats.record(rule_names[k], start, progressed=stats.eliminations + stats.placements > changes)
+            # A unit with every box filled has nothing left for any rule to do
+            if k < last and not queued[k + 1][n] and any(box.mask for box in unit):
+                queued[k + 1][n] = True
+                queues[k + 1].append(n)
+            if first:
+                k = 0
 
-            if self.grid.check_errors():
-                raise UnsolvableException("Some processing has lead to an incorrect answer, suggesting the original puzzle was not solvable")
+    def check_limits(self):
+        """Raise `SolveLimitException` if the deadline has passed, no more guesses are allowed, or it was cancelled"""
+        if self.deadline is not None and monotonic() >= self.deadline:
+            message = f"Gave up as the deadline passed, having made {self.nodes} guesses"
+        elif self.max_nodes is not None and self.nodes >= self.max_nodes:
+            message = f"Gave up after {self.nodes} guesses"
+        elif self.cancel is not None and self.cancel.is_set():
+            message = f"Gave up as the search was cancelled, having made {self.nodes} guesses"
+        else:
+            return
+        raise SolveLimitException(message, self.grid, self.nodes, self.backtracks, self.stats)
+
+    def enqueue(self, coords: Coordinate):
+        """Queue the row, column and block containing `coords` to be looked at again, starting with the first rule"""
+        queue, queued = self._queues[0], self._queued[0]
+        for n in self._cell_units[coords]:
+            if not queued[n]:
+                queued[n] = True
+                queue.append(n)
+
+    def eliminate(self, box: Box, mask: int):
+        """Remove the candidates in `mask` from the box, queueing its units if anything changed"""
+        if box.mask & mask:
+            self._trail.append((box, box.mask, box._value))
+            if self.stats is not None:
+                self.stats.eliminations += popcount(box.mask & mask)
+            box.mask &= ~mask
+            if not box.mask:
+                raise UnsolvableException(
+                    f"The box at ({box.coords} has had all possibilities removed, and thus cannot be solved"
+                )
+            self.enqueue(box.coords)
+
+    def place(self, box: Box, value: int):
+        """Fill the box with `value`, and remove it from every peer"""
+        self._trail.append((box, box.mask, box._value))
+        if self.stats is not None:
+            self.stats.placements += 1
+        box.value = value
+        self.remove_from_peers(box)
+        self.enqueue(box.coords)
+
+    def remove_from_peers(self, box: Box):
+        bit = 1 << box.value
+        for peer in self.grid.get_peers(box.coords):
+            if peer.value == box.value:
+                raise UnsolvableException(
+                    f"The boxes at {box.coords} and {peer.coords} both hold {box.value}, so the puzzle cannot be solved"
+                )
+            self.eliminate(peer, bit)
+
+    def undo(self, mark: int):
+        """Take back every change made since the trail was `mark` long, abandoning any queued work"""
+        trail = self._trail
+        while len(trail) > mark:
+            box, box.mask, box._value = trail.pop()
+        for queue, queued in zip(self._queues, self._queued):
+            for n in queue:
+                queued[n] = False
+            queue.clear()
 
     def update_possible_values(self, coords: Coordinate):
-        for array in self.grid.get_containing_arrays(coords):
-            for box in array:
-                self.handle_box(box, array)
+        self.enqueue(coords)
+        self.propagate()
+
+    @staticmethod
+    def unplaced(unit: List[Box]) -> int:
+        """The mask of every value still possible somewhere in the unit"""
+        mask = 0
+        for box in unit:
+            mask |= box.mask
+        return mask
 
-    def handle_box(self, box, array):
-        if box.is_filled:
+    def naked_singles_rule(self, n: int, unit: List[Box]):
+        """Fill any box with only one possible value left"""
+        for box in unit:
+            mask = box.mask
+            if mask and not mask & (mask - 1):
+                self.place(box, bit_value(mask))
+
+    def hidden_singles_rule(self, n: int, unit: List[Box]):
+        """Fill any box which is the only one in the unit that can hold some value
+
+        This is what was once `uniquetobox_heuristic`, or heuristic_a, for the whole unit at once.
+        """
+        once = more = placed = 0
+        for box in unit:
+            more |= once & box.mask
+            once |= box.mask
+            if box._value:
+                placed |= 1 << box._value
+        missing = full_mask(len(unit)) & ~(once | placed)
+        if missing:
+            raise UnsolvableException(f"No box of the unit {n} can hold {','.join(map(str, values_of(missing)))}")
+        once &= ~more
+        if not once:
             return
+        for box in unit:
+            unique = box.mask & once
+            if unique:
+                if unique & (unique - 1):
+                    raise UnsolvableException(
+                        f"Could not solve due to box at {box.coords} being the only box available to hold "
+                        f"{','.join(map(str, values_of(unique)))}"
+                    )
+                self.place(box, bit_value(unique))
 
-        # Remove any impossible values and finalise if necessary
-        box.possible_values -= set(BoxGrid.box_values(array))
-        if not box.possible_values:
-            raise UnsolvableException(
-                f"The box at ({box.coords} has had all possibilities removed, and thus cannot be solved"
-            )
-        elif len(box.possible_values) == 1:
-            box.finalise()
-            # If finalised, we can remove possible values from nearby items, and actually just handle the corresponding arrays
-            self.update_possible_values(box.coords)
+    def naked_subsets(self, unit: List[Box], size: int):
+        """Find `size` boxes with only `size` possible values between them, and remove those values from the rest
+
+        This is what `smallsamegrouping_heuristic` and `intersectinggrouping_heuristic` (heuristic_b and heuristic_c)
+        once did, a box at a time.
+        """
+        empty = [box for box in unit if box.mask]
+        # A subset of every empty box would have nothing to remove its values from
+        if len(empty) <= size:
             return
+        found = find_subset([box.mask for box in empty], size)
+        if found is not None:
+            indexes, mask = found
+            for i, box in enumerate(empty):
+                if i not in indexes:
+                    self.eliminate(box, mask)
 
-        for heuristic in (self.uniquetobox_heuristic, self.smallsamegrouping_heuristic, self.intersectinggrouping_heuristic):
-            r = heuristic(box, array.copy())
-            if r:
-                box.value = r
-                # If finalised, we can remove possible values from nearby items, and actually just handle the corresponding arrays
-                self.update_possible_values(box.coords)
-                break
-            else:
-                # Clear things up by doing quick finalisations without starting further recursive calls
-                for b in array:
-                    if len(b.possible_values) == 1:
-                        b.finalise()
+    def hidden_subsets(self, unit: List[Box], size: int):
+        """Find `size` values which can only go in `size` boxes between them, and remove other values from those boxes
 
-    def uniquetobox_heuristic(self, box: Box, array: List[Box]):
-        """This heuristic sees if there are any values which are unique to the box within the array
+        This is `naked_subsets` turned around, with each value's mask being of the boxes it can go in.
+        """
+        empty = [box for box in unit if box.mask]
+        if len(empty) <= size:
+            return
+        values = list(values_of(self.unplaced(empty)))
+        places = [mask_of(i for i, box in enumerate(empty) if box.mask >> value & 1) for value in values]
+        found = find_subset(places, size)
+        if found is not None:
+            indexes, boxes = found
+            mask = mask_of(values[i] for i in indexes)
+            for i in values_of(boxes):
+                self.eliminate(empty[i], ~mask)
+
+    def naked_pairs_rule(self, n: int, unit: List[Box]):
+        self.naked_subsets(unit, 2)
+
+    def naked_triples_rule(self, n: int, unit: List[Box]):
+        self.naked_subsets(unit, 3)
+
+    def naked_quads_rule(self, n: int, unit: List[Box]):
+        self.naked_subsets(unit, 4)
+
+    def hidden_pairs_rule(self, n: int, unit: List[Box]):
+        self.hidden_subsets(unit, 2)
+
+    def hidden_triples_rule(self, n: int, unit: List[Box]):
+        self.hidden_subsets(unit, 3)
+
+    def hidden_quads_rule(self, n: int, unit: List[Box]):
+        self.hidden_subsets(unit, 4)
+
+    def pointing_rule(self, n: int, unit: List[Box]):
+        """If a value can only go in one row (or column) of a block, remove it from the rest of that row (or column)"""
+        index = self.grid.index
+        if n < len(index.columns) + len(index.rows):
+            return
+        for value in values_of(self.unplaced(unit)):
+            bit = 1 << value
+            places = [index.cell_units[box.coords] for box in unit if box.mask & bit]
+            # The row and then the column of each box the value could go in
+            for line in 0, 1:
+                line_n = places[0][line]
+                if all(units[line] == line_n for units in places[1:]):
+                    for box in self.grid.get_unit(line_n):
+                        if box.mask & bit and index.cell_units[box.coords][2] != n:
+                            self.eliminate(box, bit)
+
+    def box_line_rule(self, n: int, unit: List[Box]):
+        """If a value can only go in one block along a row (or column), remove it from the rest of that block"""
+        index = self.grid.index
+        if n >= len(index.columns) + len(index.rows):
+            return
+        for value in values_of(self.unplaced(unit)):
+            bit = 1 << value
+            blocks = {index.cell_units[box.coords][2] for box in unit if box.mask & bit}
+            if len(blocks) == 1:
+                block_n, = blocks
+                for box in self.grid.get_unit(block_n):
+                    if box.mask & bit and n not in index.cell_units[box.coords][:2]:
+                        self.eliminate(box, bit)
 
-        Also know as heuristic_a
+    def choose_box(self) -> Optional[Box]:
+        """Pick the empty box with the fewest possible values left (the most constrained), or None if there are none"""
+        best, best_count = None, None
+        for column in self.grid.columns:
+            for box in column:
+                if box.mask:
+                    count = popcount(box.mask)
+                    if best_count is None or count < best_count:
+                        best, best_count = box, count
+                        if count == 2:
+                            return best
+        return best
+
+    def emergency_measures(self) -> BoxGrid:
+        """Depth first search, for when the heuristics can make no more progress, keeping the first solution found"""
+        for grid in self.search():
+            return grid
+        raise UnsolvableException('Emergency measures approach unable to solve, um, well, you\'re kind of ...d')
+
+    def search(self, rng: random.Random=None) -> Iterator[BoxGrid]:
+        """Depth first search through every way of finishing the grid, yielding the grid each time it is complete
+
+        Guesses are made in the most constrained box, and propagated just like any other placement. When a guess leads to
+        a contradiction, it is undone using the trail rather than by copying the grid, and the next possibility tried.
+        The grid is left as it is when the search is abandoned, so stopping after the first yield keeps that solution.
+        Possibilities are tried smallest first, or in a random order if given `rng`.
+
+        At most `max_emergency_depth` guesses are stacked up at once, and if that cut the search short, it finishes by
+        raising `UnfinishableException`. Running into the solver's deadline or limit of guesses raises
+        `SolveLimitException`, with the grid put back to how it was before the search, and a `Checkpoint` of how far
+        the search had got, which `resume_search` can carry on from.
         """
-        # Values which only this box has in the array
-        uniquetobox_values = box.possible_values - {possibility for other in array for possibility in other.possible_values}
-        result, *rest = uniquetobox_values or {None}
-        if rest:
-            raise UnsolvableException(
-                f"Could not solve due to box at {box.coords} being the only box available to hold {','.join(uniquetobox_values)}"
-            )
-        return result
-
-    def smallsamegrouping_heuristic(self, box: Box, array: List[Box]):
-        """This heurisitc sees if there any groups of boxes with the same possible values
-
-        They must have the same possible values, and be small (i.e. < n in a n*n grid) for it to really work.
-        It removes these possible values from any boxes not found in this group
-
-        Also know as heuristic_b
+        box = self.choose_box()
+        if box is None:
+            yield self.grid
+            return
+        self._root = self.grid.snapshot()
+        self._stack = [[box, box.mask, len(self._trail), 0]]
+        yield from self._search(rng)
+
+    def resume_search(self, checkpoint: 'Checkpoint', rng: random.Random=None) -> Iterator[BoxGrid]:
+        """Carry on a search from a checkpoint, as `search` would have if it hadn't been stopped
+
+        The grid is put back to how it was when the search started, and the guesses being tried at the time are made
+        again, so this works in any process, with any grid of the same shape.
         """
-        # As this heuristic only deals with possible values, remove any filled boxes
-        array = [b for b in array if not b.is_filled]
-        # True == 1 so this should give the number of true occurrences
-        count = sum(box.possible_values == b.possible_values for b in array)
-        # If there is the same number of boxes with only these possible values as there are possible values, only these boxes can have these values,
-        #  and any other boxes must have one of their other values
-        if count == len(box.possible_values):
-            for b in array:
-                if box.possible_values != b.possible_values and box.possible_values & b.possible_values:
-                    b.possible_values -= box.possible_values
-                elif b.possible_values < box.possible_values:
-                    raise UnsolvableException(f"Could not solved as too many boxes ({count}) must contain too few values ({box.possible_values}), "
-                                              f"and one even a subset of that ({b.possible_values}), in array {array}")
-
-        elif count > len(box.possible_values):
-            raise UnsolvableException(f"Could not solved as too many boxes ({count}) must contain too few values ({box.possible_values}), in"
-                                      f"array {array}")
-
-    def intersectinggrouping_heuristic(self, box: Box, array: List[Box]):
-        """Also known as heuristic_c"""
-        def inner(boxes: List[Box], possible_value_set: Set[int], remaining: List[Box]) -> Optional[Tuple[List[Box], Set[int]]]:
-            for other in sorted(remaining, key=lambda x: len(x.possible_values)):
-                if other.possible_values & possible_value_set:
-                    extended_pvs = other.possible_values | possible_value_set
-                    if len(extended_pvs) == len(boxes) + 1:
-                        return (boxes + [other], extended_pvs)
-                    elif len(extended_pvs) < len(boxes) + 1:
-                        raise UnsolvableException(f"There is a suggestion that too few values ({extended_pvs}) must fit in too many boxes, "
-                                                  f"{boxes + [other]}")
-                    # If next time we'll only be dealing with one
-                    if len(remaining) <= 2:
-                        # Don't bother
-                        continue
-                    remaining = remaining.copy()
-                    remaining.remove(other)
-                    r = inner(boxes + [other], extended_pvs, remaining)
-                    if isinstance(r, tuple):
-                        return r
-
-        # This handles `box` separately, and as with h_b, only deals with possible values, so remove any filled boxes
-        array = [b for b in array if not b.is_filled and b is not box]
-        r = inner([box], box.possible_values, array)
-        if isinstance(r, tuple):
-            boxes, possible_value_set = r
-            for b in array:
-                if b not in boxes and possible_value_set & b.possible_values:
-                    b.possible_values -= possible_value_set
-
-    def emergency_measures(self):
-        for depth in range(self.max_emergency_depth):
-            for column in self.grid.columns:
-                for box in column:
-                    if box.is_filled:
-                        continue
-
-                    for possibility in box.possible_values:
-                        possibility_grid = self.grid.deep_copy()
-                        possibility_grid[box.coords].value = possibility
-                        try:
-                            solver = SudokuSolver(possibility_grid, max_emergency_depth=depth)
-                            solver.solve()
-                        except UnsolvableException as e:
-                            if solver.grid and solver.grid.check_complete() and not solver.grid.check_errors():
-                                return solver.grid
-                            continue
-                        else:
-                            return solver.grid
+        self.grid.restore(checkpoint.root)
+        self._root = checkpoint.root
+        self._trail = []
+        self._entries = []
+        self.undo(0)
+        self.nodes, self.backtracks = checkpoint.nodes, checkpoint.backtracks
+        self._stack = []
+        # Making the guesses again is work already done once, so it isn't held to the deadline, and neither is the next
+        # guess, so that the search gets somewhere however little time it is given
+        deadline, self.deadline = self.deadline, None
+        for coords, remaining, value in checkpoint.decisions:
+            box = self.grid[coords]
+            frame = [box, remaining, len(self._trail), 0]
+            self._stack.append(frame)
+            if value:
+                # Guesses which were being tried were all consistent then, so they still are
+                self.place(box, value)
+                self.propagate()
+                frame[3] = 1 << value
+        yield from self._search(rng, checkpoint.depth_limited, held_deadline=deadline)
+
+    def checkpoint(self) -> Optional['Checkpoint']:
+        """How far the current (or last) search has got, or None if there hasn't been one"""
+        if self._root is None:
+            return None
+        decisions = tuple((box.coords, remaining, bit_value(guess) if guess else 0)
+                          for box, remaining, _, guess in self._stack)
+        return Checkpoint(self._root, decisions, self.nodes, self.backtracks, self._depth_limited)
+
+    def _search(self, rng: Optional[random.Random], depth_limited: bool=False, held_deadline: float=None
+                ) -> Iterator[BoxGrid]:
+        trail, stack = self._trail, self._stack
+        root = stack[0][2] if stack else len(trail)
+        limited = (self.deadline is not None or held_deadline is not None or self.max_nodes is not None
+                   or self.cancel is not None)
+        resumed = held_deadline is not None
+        self._depth_limited = depth_limited
+        try:
+            while stack:
+                frame = stack[-1]
+                box, remaining, mark, _ = frame
+                self.undo(mark)
+                frame[3] = 0
+                if not remaining:
+                    stack.pop()
+                    self.backtracks += 1
+                    if self.stats is not None:
+                        self.stats.backtracks = self.backtracks
+                        self.stats.emit('backtrack')
+                    continue
+
+                if limited and not resumed:
+                    self.check_limits()
+                bit = remaining & -remaining if rng is None else 1 << rng.choice(list(values_of(remaining)))
+                frame[1], frame[3] = remaining ^ bit, bit
+                self.nodes += 1
+                if self.stats is not None:
+                    self.stats.nodes = self.nodes
+                    self.stats.emit('guess')
+                try:
+                    self.place(box, bit_value(bit))
+                    self.propagate()
+                except SolveLimitException:
+                    # Leave the guess to be made again by whatever carries on from the checkpoint
+                    frame[1], frame[3] = remaining, 0
+                    self.nodes -= 1
+                    if self.stats is not None:
+                        self.stats.nodes = self.nodes
+                    raise
+                except UnsolvableException:
+                    continue
+                finally:
+                    if resumed:
+                        self.deadline, resumed = held_deadline, False
+
+                box = self.choose_box()
+                if box is None:
+                    yield self.grid
+                    continue
+                if len(stack) >= self.max_emergency_depth:
+                    self._depth_limited = True
+                    continue
+                stack.append([box, box.mask, len(trail), 0])
+        except SolveLimitException as e:
+            e.checkpoint = self.checkpoint()
+            self.undo(root)
+            raise
+
+        if self._depth_limited:
+            raise UnfinishableException('Cannot solve as recursive depth limit reached')
+
+    def resume(self, checkpoint: 'Checkpoint', *, deadline: float=None, max_nodes: int=None):
+        """Solve the grid in place by carrying on the search saved in `checkpoint`, as `solve` would have
+
+        `deadline` and `max_nodes` are as for `solve`, with guesses made before the checkpoint counting towards
+        `max_nodes`, so a search can be moved between processes, a slice of time at a time.
+        """
+        self.deadline, self.max_nodes = deadline, max_nodes
+        for _ in self.resume_search(checkpoint):
+            return
         raise UnsolvableException('Emergency measures approach unable to solve, um, well, you\'re kind of ...d')
 
+    def count_solutions(self, limit: int=2, *, deadline: float=None, max_nodes: int=None) -> int:
+        """Count the ways the grid can be finished, stopping as soon as `limit` have been found
+
+        This propagates and searches just as `solve` does, so finding out a puzzle is unique costs little more than
+        solving it, and takes the same `deadline` and `max_nodes`. The grid is put back as it was afterwards.
+        """
+        self.deadline, self.max_nodes = deadline, max_nodes
+        self._trail = []
+        count = 0
+        try:
+            self.propagate_givens()
+            self.propagate()
+            for _ in self.search():
+                count += 1
+                if count >= limit:
+                    break
+        except UnfinishableException:
+            raise
+        except UnsolvableException:
+            pass
+        finally:
+            self.undo(0)
+        return count
+
+
+def count_solutions(grid: BoxGrid, limit: int=2, **options) -> int:
+    """Count the solutions of the grid, up to `limit`, leaving the grid as it was"""
+    return SudokuSolver(grid, **options).count_solutions(limit)
+
+
+def is_unique(grid: BoxGrid, **options) -> bool:
+    """Whether the grid has exactly one solution"""
+    return count_solutions(grid, 2, **options) == 1
@@ -0,0 +1,67 @@
+from collections import defaultdict
+from time import perf_counter
+from typing import Callable, Dict, List
+
+# Called with the name of the event, and the stats so far
+Hook = Callable[[str, 'SolveStats'], None]
+
+
+class SolveStats:
+    """A record of the work done solving a puzzle, for working out why it was slow
+
+    For each step of the solver (each of its rules, and `emergency_measures`) it counts how many times the step
+    ran, how many of those times it got somewhere, and how long it took altogether. The time of `emergency_measures`
+    is only that of the search itself, as the rules it runs after each guess are counted as their own steps, and it only
+    got somewhere if it found a solution. Alongside are totals of
+    eliminations, placements, units looked at ('sweeps'), and guesses made and taken back in the emergency search.
+
+    Pass one to a solver to have it filled in, and when it isn't given the solver skips all of this. Hooks added with
+    `add_hook` are told about events as they happen: 'emergency', 'guess', 'backtrack' and 'solved'.
+    """
+
+    def __init__(self):
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.progress: Dict[str, int] = defaultdict(int)
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.eliminations = 0
+        self.placements = 0
+        self.sweeps = 0
+        self.nodes = 0
+        self.backtracks = 0
+        self.hooks: List[Hook] = []
+
+    def add_hook(self, hook: Hook):
+        self.hooks.append(hook)
+
+    def emit(self, event: str):
+        for hook in self.hooks:
+            hook(event, self)
+
+    def record(self, step: str, start: float, progressed: bool=False):
+        """Record a run of `step` which began at `start`, as given by `time.perf_counter`"""
+        self.seconds[step] += perf_counter() - start
+        self.calls[step] += 1
+        if progressed:
+            self.progress[step] += 1
+
+    def as_dict(self) -> dict:
+        return {
+            'steps': {step: {'calls': self.calls[step], 'progress': self.progress[step], 'seconds': self.seconds[step]}
+                      for step in self.calls},
+            'eliminations': self.eliminations,
+            'placements': self.placements,
+            'sweeps': self.sweeps,
+            'nodes': self.nodes,
+            'backtracks': self.backtracks,
+        }
+
+    def report(self) -> str:
+        lines = [f"{'step':<32}{'calls':>10}{'progress':>10}{'seconds':>12}"]
+        for step in sorted(self.calls, key=self.seconds.get, reverse=True):
+            lines.append(f"{step:<32}{self.calls[step]:>10}{self.progress[step]:>10}{self.seconds[step]:>12.6f}")
+        lines.append(f"eliminations={self.eliminations} placements={self.placements} sweeps={self.sweeps} "
+                     f"nodes={self.nodes} backtracks={self.backtracks}")
+        return '\n'.join(lines)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.as_dict()})"
@@ -0,0 +1,32 @@
+import random
+
+import pytest
+
+from batch import solve_corpus
+from generator import random_solution
+from grid import BoxGrid
+from packed import write_corpus
+
+
+def puzzles_of(block_height: int, block_width: int, count: int) -> list:
+    """Random solutions of the given shape with about half their boxes emptied"""
+    rng = random.Random(block_height * 10 + block_width)
+    return [''.join('.' if rng.random() < 0.5 else symbol for symbol in random_solution(rng, block_height, block_width))
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize('vectorize', [False, True])
+@pytest.mark.parametrize('block_height, block_width', [(3, 2), (2, 3), (4, 3)])
+def test_solve_corpus_keeps_block_shape(tmp_path, block_height, block_width, vectorize):
+    if vectorize:
+        pytest.importorskip('numpy')
+    puzzles = puzzles_of(block_height, block_width, 6)
+    path = tmp_path / 'puzzles.sdk'
+    write_corpus(path, puzzles, block_height=block_height, block_width=block_width)
+    results = list(solve_corpus(str(path), workers=1, chunksize=4, vectorize=vectorize))
+    assert [result.puzzle for result in results] == puzzles
+    for result in results:
+        assert result.solved, result.error
+        solution = BoxGrid.from_string(result.solution, block_height=block_height, block_width=block_width)
+        assert solution.check_complete() and not solution.check_errors()
+        assert all(given in '.' + solved for given, solved in zip(result.puzzle, result.solution))
@@ -0,0 +1,36 @@
+import random
+
+import pytest
+
+from grid import SYMBOLS, BoxGrid
+from packed import CorpusFile, write_corpus
+
+
+def patterned(block_height: int, block_width: int, rng: random.Random) -> str:
+    """A filled grid of the given shape with some boxes emptied, as written by `BoxGrid.to_string`"""
+    size = block_height * block_width
+    values = [(row * block_width + row // block_height + column) % size + 1
+              for row in range(size) for column in range(size)]
+    return ''.join('.' if rng.random() < 0.4 else SYMBOLS[value - 1] for value in values)
+
+
+@pytest.mark.parametrize('block_height, block_width', [(2, 3), (3, 2), (3, 3), (3, 4), (4, 4), (5, 5)])
+def test_corpus_round_trip(tmp_path, block_height, block_width):
+    rng = random.Random(block_height * 10 + block_width)
+    puzzles = [patterned(block_height, block_width, rng) for _ in range(5)]
+    path = tmp_path / 'puzzles.sdk'
+    assert write_corpus(path, puzzles, block_height=block_height, block_width=block_width) == len(puzzles)
+    with CorpusFile(path) as corpus:
+        assert (corpus.block_height, corpus.block_width) == (block_height, block_width)
+        assert list(corpus) == puzzles
+        grid = corpus.grid(len(puzzles) - 1)
+        assert (grid.block_height, grid.block_width) == (block_height, block_width)
+        assert grid.to_string() == puzzles[-1]
+
+
+def test_corpus_of_grids(tmp_path):
+    grid = BoxGrid.from_string(patterned(4, 3, random.Random(0)), block_height=4, block_width=3)
+    write_corpus(tmp_path / 'grids.sdk', [grid])
+    with CorpusFile(tmp_path / 'grids.sdk') as corpus:
+        assert corpus[0] == grid.to_string()
+        assert (corpus.block_height, corpus.block_width) == (4, 3)
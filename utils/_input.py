@@ -1,19 +1,20 @@
 from solver import *
 
-grid = BoxGrid()
+size = int(input('size >>> ') or 9)
+grid = BoxGrid(size, size)
 
 y = 0
-while y < 9:
+while y < size:
     x = 0
-    while x < 9 and y < 9:
+    while x < size and y < size:
         e = input(f'{x, y} >>> ') or 's1'
         if e.isdigit() and int(e) in grid[x, y].possible_values:
             grid[x, y].value = int(e)
             x += 1
         elif e.startswith('s'):
             x += int(e.lstrip('s'))
-            while x > 8:
-                x -= 9
+            while x >= size:
+                x -= size
                 y += 1
     print('---')
     y += 1
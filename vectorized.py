@@ -0,0 +1,168 @@
+"""Propagation of naked and hidden singles across a whole batch of puzzles at once, using NumPy
+
+A batch of N puzzles is held as an (N, boxes) array of candidate bitmasks, and each round of elimination is a
+handful of array operations over the whole batch, driven by the unit tables of `UnitIndex`. Most puzzles fall to singles
+alone; any which don't are finished off by the normal solvers, starting from the candidates already worked out here.
+
+NumPy is optional, and only needed once something here is actually used.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import engines
+from batch import BatchResult, Chunk, solve_puzzle
+from grid import SYMBOLS, BoxGrid, UnitIndex, bit_value, full_mask, unit_index
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("The vectorized engine needs NumPy, which can be installed with `pip install numpy`")
+
+
+def unit_tables(index: UnitIndex) -> Tuple['np.ndarray', 'np.ndarray']:
+    """The boxes of each unit, and the units of each box, with boxes numbered row by row as in `BoxGrid.to_string`
+
+    Returns a (units, size) array of box numbers, and a (boxes, 3) array of unit numbers.
+    """
+    require_numpy()
+    number = lambda coords: coords[1] * index.width + coords[0]
+    units = np.array([[number(coords) for coords in unit] for unit in index.units], dtype=np.intp)
+    cell_units = np.empty((index.width * index.height, 3), dtype=np.intp)
+    for coords, box_units in index.cell_units.items():
+        cell_units[number(coords)] = box_units
+    return units, cell_units
+
+
+def encode(puzzles: Sequence[str], size: int) -> 'np.ndarray':
+    """Turn puzzle strings into an (N, boxes) array of candidate bitmasks, laid out as `Box.mask`"""
+    require_numpy()
+    # Look up each character's candidates, with every value possible for anything empty
+    lookup = np.full(128, full_mask(size), dtype=np.uint32)
+    for value, symbol in enumerate(SYMBOLS[:size], 1):
+        lookup[ord(symbol)] = lookup[ord(symbol.lower())] = 1 << value
+    raw = np.frombuffer(''.join(puzzles).encode('ascii'), dtype=np.uint8).reshape(len(puzzles), size * size)
+    return lookup[raw]
+
+
+def once_and_more(masks: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray']:
+    """For (N, units, size) masks, the values appearing in at least one, and in more than one, box of each unit"""
+    once = np.zeros(masks.shape[:2], dtype=masks.dtype)
+    more = np.zeros_like(once)
+    for n in range(masks.shape[2]):
+        more |= once & masks[:, :, n]
+        once |= masks[:, :, n]
+    return once, more
+
+
+def propagate(candidates: 'np.ndarray', units: 'np.ndarray', cell_units: 'np.ndarray', size: int) -> 'np.ndarray':
+    """Apply naked and hidden singles to every puzzle of the batch until none of them change, in place
+
+    A box is treated as filled once it has a single candidate left. Returns an (N,) array which is True for each puzzle
+    found to contradict itself, whose candidates are then meaningless.
+    """
+    full = full_mask(size)
+    failed = np.zeros(len(candidates), dtype=bool)
+    while True:
+        # Naked singles: values already settled in a unit are removed from every other box of that unit
+        single = (candidates & (candidates - 1)) == 0
+        settled, settled_twice = once_and_more(np.where(single, candidates, 0)[:, units])
+        failed |= (settled_twice != 0).any(axis=1)
+        taken = np.bitwise_or.reduce(settled[:, cell_units], axis=2)
+        updated = np.where(single, candidates, candidates & ~taken)
+
+        # Hidden singles: a value with only one place left in a unit must go there
+        anywhere, twice = once_and_more(updated[:, units])
+        failed |= (anywhere != full).any(axis=1)
+        hidden = updated & np.bitwise_or.reduce((anywhere & ~twice)[:, cell_units], axis=2)
+        failed |= ((hidden & (hidden - 1)) != 0).any(axis=1)
+        updated = np.where(hidden != 0, hidden, updated)
+
+        failed |= (updated == 0).any(axis=1)
+        if np.array_equal(updated, candidates):
+            return failed
+        candidates[:] = updated
+
+
+def to_grid(candidates: 'np.ndarray', index: UnitIndex) -> BoxGrid:
+    """Build a grid from one puzzle's candidate bitmasks, filling any box with only one left"""
+    grid = BoxGrid(index.height, index.width, block_height=index.block_height, block_width=index.block_width)
+    for n, mask in enumerate(candidates.tolist()):
+        box = grid[n % index.width, n // index.width]
+        if mask & (mask - 1):
+            box.mask = mask
+        else:
+            box.value = bit_value(mask)
+    return grid
+
+
+def solve_batch(puzzles: Sequence[str], *, engine: str='heuristic', numbers: Sequence[int]=None,
+                block_height: int=None, block_width: int=None) -> List[BatchResult]:
+    """Solve a batch of valid puzzles of the same size, using vectorized propagation and then `engine` for what is left
+
+    Results are numbered by `numbers`, or by their position in `puzzles`. The blocks are the usual shape for the size
+    unless given. Puzzles which contradict themselves are handed to `engine` untouched, so that they fail with its usual
+    explanation.
+    """
+    shape = dict(block_height=block_height, block_width=block_width)
+    require_numpy()
+    if not puzzles:
+        return []
+    numbers = range(len(puzzles)) if numbers is None else numbers
+    size = round(len(puzzles[0]) ** 0.5)
+    grid = BoxGrid(size, size, **shape)
+    index = unit_index(size, size, grid.block_height, grid.block_width)
+    if any(len(unit) != size for unit in index.units):
+        # Blocks which don't tile the grid can't be laid out as one array, so leave them to be reported on
+        return [solve_puzzle(n, puzzle, engine, **shape) for n, puzzle in zip(numbers, puzzles)]
+    units, cell_units = unit_tables(index)
+
+    candidates = encode(puzzles, size)
+    failed = propagate(candidates, units, cell_units, size)
+    solved = ((candidates & (candidates - 1)) == 0).all(axis=1) & ~failed
+    # Only the solved puzzles have a single candidate everywhere, so log2 gives their values
+    symbols = np.frombuffer(('.' + SYMBOLS[:size]).encode('ascii'), dtype=np.uint8)
+    solutions = symbols[np.log2(np.where(solved[:, None], candidates, 1)).astype(np.intp)].tobytes().decode('ascii')
+    boxes = size * size
+
+    results = []
+    for n, puzzle in enumerate(puzzles):
+        if solved[n]:
+            results.append(BatchResult(numbers[n], puzzle, solutions[n * boxes:(n + 1) * boxes]))
+        elif failed[n]:
+            results.append(solve_puzzle(numbers[n], puzzle, engine, **shape))
+        else:
+            try:
+                grid = to_grid(candidates[n], index)
+                engines.solve(grid, engine=engine)
+            except Exception as e:
+                results.append(BatchResult(numbers[n], puzzle, None, e))
+            else:
+                results.append(BatchResult(numbers[n], puzzle, grid.to_string()))
+    return results
+
+
+def solve_chunk(chunk: Chunk, engine: str='heuristic', block_height: int=None, block_width: int=None
+                ) -> List[BatchResult]:
+    """Solve a chunk of `batch.solve_many`, with the puzzles of each size done as one vectorized batch
+
+    Anything which isn't a well formed puzzle is left to `batch.solve_puzzle` to report on. A shape of blocks, if given,
+    is used for every puzzle, as it is for those of a corpus file.
+    """
+    shape = dict(block_height=block_height, block_width=block_width)
+    results: List[BatchResult] = []
+    by_size: Dict[int, Chunk] = {}
+    for n, puzzle in chunk:
+        size = round(len(puzzle) ** 0.5)
+        if size * size == len(puzzle) and set(puzzle) <= set('.0' + SYMBOLS[:size] + SYMBOLS[:size].lower()):
+            by_size.setdefault(size, []).append((n, puzzle))
+        else:
+            results.append(solve_puzzle(n, puzzle, engine, **shape))
+    for same_size in by_size.values():
+        numbers, puzzles = zip(*same_size)
+        results.extend(solve_batch(puzzles, engine=engine, numbers=numbers, **shape))
+    results.sort(key=lambda result: result.index)
+    return results